@@ -0,0 +1,193 @@
+import math
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, without it the filter loops run as plain python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+k3y_g = 9.87
+S3_K3Y_VEH_ROT_MTX = np.array([[1, 0, 0], [0, -1, 0], [0, 0, -1]])
+
+# default filter parameters, quaternions are scalar first as in the ahrs library
+def default_params(filter_type='madgwick'):
+    params = {'filter': filter_type, 'SR': 100, 'init_qua': [0, 0, 0, 1]}
+    if filter_type == 'madgwick':
+        params['gain'] = 0.033
+    else:
+        params['k_P'] = 1.0
+        params['k_I'] = 0.3
+        params['bias'] = [0.0, 0.0, 0.0]
+    return params
+
+# madgwick imu update over every sample, matching ahrs.filters.Madgwick.updateIMU,
+# when skip_first is set the first output is q0 itself as in the ahrs library
+@njit(cache=True)
+def _madgwick(acc, gyr, dt, gain, q0, out, skip_first):
+    norm = math.sqrt(q0[0]**2 + q0[1]**2 + q0[2]**2 + q0[3]**2)
+    qw, qx, qy, qz = q0[0] / norm, q0[1] / norm, q0[2] / norm, q0[3] / norm
+    start = 0
+    if skip_first:
+        out[0, 0], out[0, 1], out[0, 2], out[0, 3] = qw, qx, qy, qz
+        start = 1
+
+    for t in range(start, acc.shape[0]):
+        gx, gy, gz = gyr[t, 0], gyr[t, 1], gyr[t, 2]
+        if gx * gx + gy * gy + gz * gz > 0:
+            # rate of change from the gyroscope
+            dw = 0.5 * (-qx * gx - qy * gy - qz * gz)
+            dx = 0.5 * (qw * gx + qy * gz - qz * gy)
+            dy = 0.5 * (qw * gy - qx * gz + qz * gx)
+            dz = 0.5 * (qw * gz + qx * gy - qy * gx)
+
+            # gradient descent correction towards the measured gravity
+            ax, ay, az = acc[t, 0], acc[t, 1], acc[t, 2]
+            a_norm = math.sqrt(ax * ax + ay * ay + az * az)
+            if a_norm > 0:
+                ax, ay, az = ax / a_norm, ay / a_norm, az / a_norm
+                f0 = 2.0 * (qx * qz - qw * qy) - ax
+                f1 = 2.0 * (qw * qx + qy * qz) - ay
+                f2 = 2.0 * (0.5 - qx * qx - qy * qy) - az
+                if f0 * f0 + f1 * f1 + f2 * f2 > 0:
+                    s0 = -2.0 * qy * f0 + 2.0 * qx * f1
+                    s1 = 2.0 * qz * f0 + 2.0 * qw * f1 - 4.0 * qx * f2
+                    s2 = -2.0 * qw * f0 + 2.0 * qz * f1 - 4.0 * qy * f2
+                    s3 = 2.0 * qx * f0 + 2.0 * qy * f1
+                    s_norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+                    if s_norm > 0:
+                        dw -= gain * s0 / s_norm
+                        dx -= gain * s1 / s_norm
+                        dy -= gain * s2 / s_norm
+                        dz -= gain * s3 / s_norm
+
+            qw, qx, qy, qz = qw + dw * dt, qx + dx * dt, qy + dy * dt, qz + dz * dt
+            norm = math.sqrt(qw * qw + qx * qx + qy * qy + qz * qz)
+            qw, qx, qy, qz = qw / norm, qx / norm, qy / norm, qz / norm
+        out[t, 0], out[t, 1], out[t, 2], out[t, 3] = qw, qx, qy, qz
+
+# mahony imu update over every sample, matching ahrs.filters.Mahony.updateIMU,
+# the gyro bias estimate is updated in place
+@njit(cache=True)
+def _mahony(acc, gyr, dt, k_P, k_I, q0, bias, out, skip_first):
+    norm = math.sqrt(q0[0]**2 + q0[1]**2 + q0[2]**2 + q0[3]**2)
+    qw, qx, qy, qz = q0[0] / norm, q0[1] / norm, q0[2] / norm, q0[3] / norm
+    start = 0
+    if skip_first:
+        out[0, 0], out[0, 1], out[0, 2], out[0, 3] = qw, qx, qy, qz
+        start = 1
+
+    for t in range(start, acc.shape[0]):
+        gx, gy, gz = gyr[t, 0], gyr[t, 1], gyr[t, 2]
+        if gx * gx + gy * gy + gz * gz > 0:
+            ax, ay, az = acc[t, 0], acc[t, 1], acc[t, 2]
+            a_norm = math.sqrt(ax * ax + ay * ay + az * az)
+            if a_norm > 0:
+                ax, ay, az = ax / a_norm, ay / a_norm, az / a_norm
+                # expected gravity direction in the sensor frame
+                vx = 2.0 * (qx * qz - qw * qy)
+                vy = 2.0 * (qw * qx + qy * qz)
+                vz = 1.0 - 2.0 * (qx * qx + qy * qy)
+                # error between the measured and expected gravity
+                ex = ay * vz - az * vy
+                ey = az * vx - ax * vz
+                ez = ax * vy - ay * vx
+                bias[0] -= k_I * ex * dt
+                bias[1] -= k_I * ey * dt
+                bias[2] -= k_I * ez * dt
+                gx = gx - bias[0] + k_P * ex
+                gy = gy - bias[1] + k_P * ey
+                gz = gz - bias[2] + k_P * ez
+
+            dw = 0.5 * (-qx * gx - qy * gy - qz * gz)
+            dx = 0.5 * (qw * gx + qy * gz - qz * gy)
+            dy = 0.5 * (qw * gy - qx * gz + qz * gx)
+            dz = 0.5 * (qw * gz + qx * gy - qy * gx)
+            qw, qx, qy, qz = qw + dw * dt, qx + dx * dt, qy + dy * dt, qz + dz * dt
+            norm = math.sqrt(qw * qw + qx * qx + qy * qy + qz * qz)
+            qw, qx, qy, qz = qw / norm, qx / norm, qy / norm, qz / norm
+        out[t, 0], out[t, 1], out[t, 2], out[t, 3] = qw, qx, qy, qz
+
+# run the filter over a chunk of samples, carrying the state to the next chunk through filter_params,
+# the first chunk starts at init_qua and later chunks continue as if the data had not been split
+def calculate_quaternions(ac_data, gy_data, filter_params, out=None):
+    ac_data = np.ascontiguousarray(ac_data, dtype=np.float64)
+    gy_data = np.ascontiguousarray(gy_data, dtype=np.float64)
+    if out is None:
+        out = np.empty((len(ac_data), 4))
+    if len(ac_data) == 0:
+        return out
+
+    q0 = np.asarray(filter_params['init_qua'], dtype=np.float64)
+    skip_first = not filter_params.get('resume', False)
+    dt = 1 / filter_params['SR']
+    if filter_params.get('filter', 'madgwick') == 'madgwick':
+        _madgwick(ac_data, gy_data, dt, filter_params['gain'], q0, out, skip_first)
+    else:
+        bias = np.array(filter_params.get('bias', [0.0, 0.0, 0.0]), dtype=np.float64)
+        _mahony(ac_data, gy_data, dt, filter_params['k_P'], filter_params['k_I'], q0, bias, out, skip_first)
+        filter_params['bias'] = bias
+
+    filter_params['init_qua'] = out[-1].copy()
+    filter_params['resume'] = True
+    return out
+
+# rotation matrices from the filter quaternions, only needed when the full matrices are wanted
+def calculate_rot_matrix(ac_data, gy_data, filter_params):
+    quaternions = calculate_quaternions(ac_data, gy_data, filter_params)
+    qw, qx, qy, qz = (quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True)).T
+    return np.stack((np.column_stack((1 - 2 * (qy**2 + qz**2), 2 * (qx * qy - qw * qz), 2 * (qx * qz + qw * qy))),
+                     np.column_stack((2 * (qx * qy + qw * qz), 1 - 2 * (qx**2 + qz**2), 2 * (qy * qz - qw * qx))),
+                     np.column_stack((2 * (qx * qz - qw * qy), 2 * (qy * qz + qw * qx), 1 - 2 * (qx**2 + qy**2)))), axis=1)
+
+# gravity direction in the sensor frame, the last row of each rotation matrix, straight from the quaternions
+def gravity_direction(quaternions):
+    qw, qx, qy, qz = quaternions.T
+    norm_sq = qw**2 + qx**2 + qy**2 + qz**2
+    return np.column_stack((2.0 * (qx * qz - qw * qy) / norm_sq,
+                            2.0 * (qy * qz + qw * qx) / norm_sq,
+                            1.0 - 2.0 * (qx**2 + qy**2) / norm_sq))
+
+def gravity_compensate(ac_batch, gy_batch, filter_params, g=k3y_g):
+    quaternions = calculate_quaternions(ac_batch, gy_batch, filter_params)
+    return np.asarray(ac_batch, dtype=np.float64) - g * gravity_direction(quaternions)
+
+# rotate every row of a (N, 3) array by the same matrix
+def rotate(rot_mtx, data):
+    return np.einsum('ij,nj->ni', rot_mtx, data)
+
+# the mounting rotation and gravity of a device at a timestamp: its stored calibration when one is valid then,
+# otherwise the fixed S3 K3Y mounting
+def vehicle_rotation(organization_id=None, k3y_id=None, timestamp=None):
+    if organization_id is not None and k3y_id is not None and timestamp is not None:
+        import calibration
+        stored = calibration.find_calibration(organization_id, k3y_id, timestamp)
+        if stored is not None:
+            return np.array(stored['rotation']), stored['g']
+    return S3_K3Y_VEH_ROT_MTX, k3y_g
+
+def _resolve_rotation(rot_mtx, g, organization_id, k3y_id, ac_batch_np):
+    if rot_mtx is not None and g is not None:
+        return rot_mtx, g
+    timestamp = float(ac_batch_np[0, 0]) if len(ac_batch_np) else None
+    stored_mtx, stored_g = vehicle_rotation(organization_id, k3y_id, timestamp)
+    return (stored_mtx if rot_mtx is None else rot_mtx), (stored_g if g is None else g)
+
+# rot_mtx and g default to the device's stored calibration (calibration.get_calibration) when the device is given
+def imu_k3y_to_vehicle(ac_batch_np, gy_batch_np, filter_params, rot_mtx=None, g=None, organization_id=None, k3y_id=None):
+    rot_mtx, g = _resolve_rotation(rot_mtx, g, organization_id, k3y_id, ac_batch_np)
+    g_removed_ac_np = gravity_compensate(ac_batch_np[:, 1:], gy_batch_np[:, 1:], filter_params, g=g)
+    vehicle_ac_np = np.column_stack((ac_batch_np[:, 0], rotate(rot_mtx, g_removed_ac_np)))
+    vehicle_gy_np = np.column_stack((gy_batch_np[:, 0], rotate(rot_mtx, gy_batch_np[:, 1:])))
+
+    return vehicle_ac_np, vehicle_gy_np
+
+# convert (accel, gyro) chunks to the vehicle frame one at a time, carrying the filter state between them
+def iter_imu_k3y_to_vehicle(chunks, filter_params, rot_mtx=None, g=None, organization_id=None, k3y_id=None):
+    for ac_batch_np, gy_batch_np in chunks:
+        # the calibration is looked up once, at the first chunk
+        rot_mtx, g = _resolve_rotation(rot_mtx, g, organization_id, k3y_id, ac_batch_np)
+        yield imu_k3y_to_vehicle(ac_batch_np, gy_batch_np, filter_params, rot_mtx, g)
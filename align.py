@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+ACC_COLUMNS = ['lr_acc(m/s^2)', 'bf_acc(m/s^2)', 'vert_acc(m/s^2)']
+GYRO_COLUMNS = ['lr_w(rad/s)', 'bf_w(rad/s)', 'vert_w(rad/s)']
+CAN_COLUMNS = ['lr_acc', 'bf_acc', 'vert_acc']
+# samples further than this from a grid point are treated as missing
+IMU_TOLERANCE = 0.01
+CAN_TOLERANCE = 0.1
+
+# the timestamp column of an imu frame, the corrected clock when it is available
+def imu_time_column(imu_df):
+    if 'correct_timestamp' in imu_df.columns:
+        return 'correct_timestamp'
+    return 'timestamp(epoch in sec)'
+
+# times and values of a frame in time order, only sorting when the data is not already sorted
+def sorted_arrays(df, time_column, columns):
+    times = df[time_column].to_numpy(dtype=np.float64)
+    values = df[columns].to_numpy()
+    if len(times) > 1 and not np.all(times[1:] >= times[:-1]):
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        values = values[order]
+    return times, values
+
+# the rows of a frame where every one of the columns is finite, parsed CAN files interleave their signals
+# so each row only carries one group of them (speed, acceleration, angular rate, position or ap_state)
+def finite_rows(df, columns):
+    finite = np.isfinite(df[columns].to_numpy(dtype=np.float64)).all(axis=1)
+    return df if finite.all() else df[finite]
+
+# index of the source sample matched to each target time, -1 when none is within the tolerance,
+# direction follows pandas.merge_asof: 'backward', 'forward' or 'nearest'
+def asof_index(source_times, target_times, tolerance, direction='nearest'):
+    n = len(source_times)
+    if n == 0:
+        return np.full(len(target_times), -1)
+    if direction == 'backward':
+        index = np.searchsorted(source_times, target_times, side='right') - 1
+    elif direction == 'forward':
+        index = np.searchsorted(source_times, target_times, side='left')
+    elif direction == 'nearest':
+        right = np.searchsorted(source_times, target_times, side='left')
+        left = right - 1
+        left_gap = target_times - source_times[np.clip(left, 0, n - 1)]
+        right_gap = source_times[np.clip(right, 0, n - 1)] - target_times
+        use_right = (left < 0) | ((right < n) & (right_gap < left_gap))
+        index = np.where(use_right, right, left)
+    else:
+        raise ValueError(f"direction must be 'backward', 'forward' or 'nearest', got {direction!r}")
+
+    in_range = (index >= 0) & (index < n)
+    index_clip = np.clip(index, 0, n - 1)
+    valid = in_range & (np.abs(source_times[index_clip] - target_times) <= tolerance)
+    return np.where(valid, index_clip, -1)
+
+# values of a sorted source at the target times, nan where no sample is within the tolerance
+def align_values(source_times, source_values, target_times, tolerance, method='nearest'):
+    index = asof_index(source_times, target_times, tolerance, 'nearest')
+    valid = index >= 0
+    out = np.full((len(target_times), source_values.shape[1]), np.nan, dtype=np.float32)
+    if method == 'nearest':
+        out[valid] = source_values[index[valid]]
+    elif method == 'linear':
+        for column in range(source_values.shape[1]):
+            out[valid, column] = np.interp(target_times[valid], source_times, source_values[:, column])
+    else:
+        raise ValueError(f"method must be 'nearest' or 'linear', got {method!r}")
+    return out
+
+# join accel, gyro and optionally CAN acceleration onto one time grid, either the accel timestamps
+# or a fixed rate grid over the time the imu streams overlap, as a compact float32 frame
+def align_streams(acc_df, gyro_df, can_df=None, rate=None, method='nearest',
+                  imu_tolerance=IMU_TOLERANCE, can_tolerance=CAN_TOLERANCE, time_column=None):
+    # each imu frame is read on its own corrected clock when it has one
+    acc_times, acc_values = sorted_arrays(acc_df, time_column or imu_time_column(acc_df), ACC_COLUMNS)
+    gyro_times, gyro_values = sorted_arrays(gyro_df, time_column or imu_time_column(gyro_df), GYRO_COLUMNS)
+
+    if rate is None:
+        grid = acc_times
+        acc_aligned = acc_values.astype(np.float32)
+    else:
+        start = max(acc_times[0], gyro_times[0]) if len(acc_times) and len(gyro_times) else 0.0
+        end = min(acc_times[-1], gyro_times[-1]) if len(acc_times) and len(gyro_times) else 0.0
+        grid = start + np.arange(max(0, int(np.floor((end - start) * rate)) + 1)) / rate
+        acc_aligned = align_values(acc_times, acc_values, grid, imu_tolerance, method)
+    gyro_aligned = align_values(gyro_times, gyro_values, grid, imu_tolerance, method)
+
+    # keep only the grid points where both imu sensors have a sample
+    keep = ~(np.isnan(acc_aligned).any(axis=1) | np.isnan(gyro_aligned).any(axis=1))
+    data = {'timestamp': grid[keep]}
+    for column, values in zip(ACC_COLUMNS, acc_aligned[keep].T):
+        data[column] = values
+    for column, values in zip(GYRO_COLUMNS, gyro_aligned[keep].T):
+        data[column] = values
+
+    if can_df is not None:
+        can_times, can_values = sorted_arrays(finite_rows(can_df, CAN_COLUMNS), 'timestamp', CAN_COLUMNS)
+        can_aligned = align_values(can_times, can_values, grid[keep], can_tolerance, method)
+        for column, values in zip(CAN_COLUMNS, can_aligned.T):
+            data['can_' + column] = values
+
+    return pd.DataFrame(data)
+
+# (N, 4) timestamp + axis arrays of an aligned frame in the layout ahrs_engine.imu_k3y_to_vehicle expects
+def ahrs_arrays(aligned_df):
+    times = aligned_df['timestamp'].to_numpy(dtype=np.float64)
+    acc_np = np.column_stack((times, aligned_df[ACC_COLUMNS].to_numpy(dtype=np.float64)))
+    gyro_np = np.column_stack((times, aligned_df[GYRO_COLUMNS].to_numpy(dtype=np.float64)))
+    return acc_np, gyro_np
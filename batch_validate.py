@@ -0,0 +1,152 @@
+import os
+import time
+import argparse
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+import monitor_motion_state
+import tracing
+
+JOB_COLUMNS = ['organization_id', 'can_k3y_id', 'imu_k3y_id', 'date']
+RESULT_COLUMNS = JOB_COLUMNS + ['status', 'tpr', 'fpr', 'tpr_weighted', 'fpr_weighted', 'error', 'attempts', 'duration']
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_TIMEOUT = 15 * 60
+DEFAULT_RETRIES = 2
+
+# read the (organization_id, can_k3y_id, imu_k3y_id, date) jobs from a csv or parquet manifest
+def read_manifest(path):
+    import pandas as pd
+    if path.endswith('.parquet'):
+        manifest = pd.read_parquet(path)
+    else:
+        # keep the k3y ids as strings, an all-digit id would otherwise be parsed as a number
+        manifest = pd.read_csv(path, dtype=str)
+    missing = [column for column in JOB_COLUMNS if column not in manifest.columns]
+    if missing:
+        raise ValueError(f'manifest {path} is missing columns {missing}')
+    manifest = manifest[JOB_COLUMNS].copy()
+    # a parquet date column may hold datetimes, which would otherwise become 'YYYY-MM-DD 00:00:00'
+    manifest['date'] = pd.to_datetime(manifest['date']).dt.strftime('%Y-%m-%d')
+    manifest = manifest.astype(str).drop_duplicates()
+    return [tuple(job) for job in manifest.itertuples(index=False)]
+
+# read the results of a previous run, empty if there are none yet
+def read_results(path):
+    import pandas as pd
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.read_parquet(path)
+
+# replace the results file atomically so an interrupted run never leaves it half written
+def write_results(results_df, path):
+    tmp_path = path + '.tmp'
+    results_df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def _run_job(conn, job):
+    # drop the spans inherited from the parent when the worker was forked
+    tracing.clear()
+    try:
+        result = monitor_motion_state.validate_day(*job)
+        conn.send(('ok', result, None))
+    except Exception:
+        conn.send(('error', None, traceback.format_exc()))
+    finally:
+        conn.close()
+        # worker processes exit without running atexit handlers, so write their trace here
+        if tracing.enabled() and tracing.TRACE_PATH is not None:
+            tracing.save()
+
+# run the jobs across worker processes, killing any that exceed the timeout and retrying failures,
+# yields one result row per job as it finishes
+def run_jobs(jobs, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    context = multiprocessing.get_context()
+    pending = deque((job, 1) for job in jobs)
+    running = {}
+
+    while pending or running:
+        # keep every worker busy
+        while pending and len(running) < workers:
+            job, attempt = pending.popleft()
+            parent_conn, child_conn = context.Pipe(duplex=False)
+            process = context.Process(target=_run_job, args=(child_conn, job), daemon=True)
+            process.start()
+            child_conn.close()
+            running[parent_conn] = (process, job, attempt, time.time())
+
+        # wait until a job finishes or the earliest deadline passes
+        next_deadline = min(start + timeout for _, _, _, start in running.values())
+        ready = wait(list(running), timeout=max(0, next_deadline - time.time()))
+
+        finished = []
+        for conn in ready:
+            process, job, attempt, start = running.pop(conn)
+            try:
+                status, result, error = conn.recv()
+            except EOFError:
+                status, result, error = 'error', None, 'worker exited without a result'
+            conn.close()
+            process.join()
+            finished.append((job, attempt, start, status, result, error))
+
+        now = time.time()
+        for conn in [conn for conn, (_, _, _, start) in running.items() if now - start >= timeout]:
+            process, job, attempt, start = running.pop(conn)
+            process.kill()
+            process.join()
+            conn.close()
+            finished.append((job, attempt, start, 'timeout', None, f'timed out after {timeout} s'))
+
+        for job, attempt, start, status, result, error in finished:
+            if status != 'ok' and attempt <= retries:
+                pending.append((job, attempt + 1))
+                continue
+            row = dict(zip(JOB_COLUMNS, job))
+            row.update({'status': status,
+                        'tpr': result['tpr'] if result else None,
+                        'fpr': result['fpr'] if result else None,
+                        'tpr_weighted': result['tpr_weighted'] if result else None,
+                        'fpr_weighted': result['fpr_weighted'] if result else None,
+                        'error': error,
+                        'attempts': attempt,
+                        'duration': now - start})
+            yield row
+
+# validate every job in the manifest not already completed in the results file
+def run_batch(manifest_path, results_path, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+    jobs = read_manifest(manifest_path)
+    results_df = read_results(results_path)
+
+    # skip the jobs that already succeeded, failed jobs are tried again
+    done_df = results_df[results_df['status'] == 'ok']
+    done = set(tuple(job) for job in done_df[JOB_COLUMNS].astype(str).itertuples(index=False))
+    todo = [job for job in jobs if job not in done]
+    print(f'{len(jobs) - len(todo)} of {len(jobs)} jobs already complete, running {len(todo)}')
+
+    rows = []
+    for row in run_jobs(todo, workers, timeout, retries):
+        rows.append(row)
+        print(f"{row['organization_id']} {row['imu_k3y_id']} {row['date']}: {row['status']} ({len(rows)}/{len(todo)})")
+        results_df = _merge_results(done_df, rows)
+        write_results(results_df, results_path)
+
+    return _merge_results(done_df, rows)
+
+def _merge_results(done_df, rows):
+    import pandas as pd
+    new_df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    if done_df.empty:
+        return new_df.reset_index(drop=True)
+    return pd.concat([done_df, new_df], ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compute the motion state TPR/FPR for many device-days.')
+    parser.add_argument('manifest', help='csv or parquet with organization_id, can_k3y_id, imu_k3y_id and date columns')
+    parser.add_argument('results', help='parquet file the consolidated results are written to')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='seconds before a job is killed')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help='extra attempts for failed jobs')
+    args = parser.parse_args()
+
+    run_batch(args.manifest, args.results, args.workers, args.timeout, args.retries)
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+from tracing import current_rss
+
+SCALES = {'1h': 3600, '1d': 86400, '1w': 7 * 86400, '1m': 30 * 86400}
+RSS_SAMPLE_INTERVAL = 0.01
+# the entry points of the short jobs and how long importing each may take before any work starts
+IMPORT_MODULES = ['fetch_data', 'fetch_data_async', 'monitor_motion_state', 'batch_validate', 'plot_data']
+IMPORT_BUDGET = 0.5
+
+# sample the resident memory in the background to find the peak while a stage runs
+class PeakRSS:
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+# run one stage, recording wall time, rows processed, throughput and peak memory
+def measure(results, scale, stage, func, rows):
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        output = func()
+        wall_time = time.perf_counter() - start
+    n_rows = rows(output) if callable(rows) else rows
+    results.append({'scale': scale,
+                    'stage': stage,
+                    'wall_time': wall_time,
+                    'rows': n_rows,
+                    'rows_per_sec': n_rows / wall_time if wall_time > 0 else float('inf'),
+                    'peak_rss_mb': rss.peak / 1024**2})
+    print(f'{scale:>4} {stage:<22} {wall_time:9.3f} s {n_rows:>12} rows {results[-1]["rows_per_sec"]:>14.0f} rows/s {results[-1]["peak_rss_mb"]:9.1f} MB')
+    return output
+
+# run the fetch -> correct -> validate path for one scale against synthetic data
+def run_scale(results, scale, duration, imu_rate, seed, org_id='bench'):
+    import boto3
+    import synthetic_data
+    import metrics
+    import monitor_motion_state as mms
+
+    k3y_id = f'{scale}-{seed}'
+    config = synthetic_data.default_config(duration=duration, seed=seed)
+    config['imu_rate'] = imu_rate
+    s3_client = boto3.client('s3')
+    measure(results, scale, 'generate_upload', lambda: synthetic_data.upload_device(s3_client, org_id, k3y_id, config),
+            int(duration * imu_rate))
+
+    start_date = datetime.datetime.strptime(config['start'], '%Y-%m-%d')
+    end_date = start_date + datetime.timedelta(days=max(0, int(-(-duration // synthetic_data.DAY)) - 1))
+    end_date = datetime.datetime.combine(end_date, datetime.time.max)
+
+    imu_df = measure(results, scale, 'fetch_imu_data', lambda: mms.fetch_imu_data(k3y_id, org_id, start_date, end_date), len)
+    measure(results, scale, 'fetch_imu_data_cached', lambda: mms.fetch_imu_data(k3y_id, org_id, start_date, end_date), len)
+    time_df = measure(results, scale, 'fetch_time_data', lambda: mms.fetch_time_data(k3y_id, org_id, start_date, end_date), len)
+    can_df = measure(results, scale, 'get_can_data', lambda: mms.get_can_data(k3y_id, org_id, start_date, end_date), len)
+    event_dict = measure(results, scale, 'get_events', lambda: mms.get_events(k3y_id, org_id, start_date, end_date),
+                         lambda events: sum(len(windows) for windows in events.values()))
+
+    imu_df = measure(results, scale, 'shift_time', lambda: mms.shift_time(imu_df, time_df), len)
+    can_dr_df = measure(results, scale, 'get_can_driving_data', lambda: mms.get_can_driving_data(can_df, imu_df), len(imu_df))
+    imu_dr_df = measure(results, scale, 'get_imu_driving_data', lambda: mms.get_imu_driving_data(imu_df, time_df), len(imu_df))
+    measure(results, scale, 'TPR', lambda: mms.TPR(can_dr_df, imu_dr_df, event_dict), len(can_dr_df) + len(imu_dr_df))
+    measure(results, scale, 'FPR', lambda: mms.FPR(imu_df, imu_dr_df, event_dict), len(imu_df) + len(imu_dr_df))
+    metrics_df = measure(results, scale, 'window_metrics', lambda: metrics.window_metrics(imu_df, can_df, event_dict), len(imu_df))
+    results[-1]['valid'] = check_window_metrics(metrics_df)
+
+# every driving window of the synthetic data should pair imu with CAN samples and give finite errors,
+# which needs the sparse interleaved CAN rows to be matched on the rows that carry acceleration
+def check_window_metrics(metrics_df):
+    driving = metrics_df[metrics_df['state'] == 'driving_state']
+    finite = driving[['bias', 'rmse']].notna().all(axis=1) & (driving['n'] > 0)
+    valid = bool(len(driving)) and bool(finite.all())
+    print(f'{"":>4} {"window_metrics":<22} {"ok" if valid else f"{(~finite).sum()} of {len(driving)} driving rows without finite bias/rmse"}')
+    return valid
+
+# import each module in a fresh interpreter and compare the time taken against the budget
+def check_import_times(modules=IMPORT_MODULES, budget=IMPORT_BUDGET):
+    code = 'import sys, time; start = time.perf_counter(); __import__(sys.argv[1]); print(time.perf_counter() - start)'
+    results = []
+    for module in modules:
+        output = subprocess.run([sys.executable, '-c', code, module], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        import_time = float(output.stdout.split()[-1])
+        results.append({'module': module, 'import_time': import_time, 'within_budget': import_time <= budget})
+        print(f'{module:<22} {import_time:9.3f} s {"ok" if import_time <= budget else f"over the {budget} s budget"}')
+    return results
+
+def run_benchmarks(scales, imu_rate=100, seed=0):
+    # moto has to be imported before any boto3 client is created so that the clients can be intercepted,
+    # s3_fetch only creates its client on first use
+    from moto import mock_aws
+
+    results = []
+    # keep the object cache and key index of the run away from the real ones
+    work_dir = tempfile.mkdtemp(prefix='imu_bench_')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    try:
+        with mock_aws():
+            import boto3
+            import s3_cache
+            import key_index
+            import synthetic_data
+            s3_cache.CACHE_DIR = os.path.join(work_dir, 'cache')
+            key_index.INDEX_DIR = os.path.join(work_dir, 'index')
+            synthetic_data.create_buckets(boto3.client('s3'))
+            for scale in scales:
+                run_scale(results, scale, SCALES[scale], imu_rate, seed)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the fetch -> correct -> validate path on synthetic data.')
+    parser.add_argument('--scales', nargs='+', default=['1h', '1d'], choices=list(SCALES))
+    parser.add_argument('--rate', type=int, default=100, help='imu sample rate in Hz')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--imports', action='store_true', help='only check the import time of the entry points')
+    args = parser.parse_args()
+
+    if args.imports:
+        results = check_import_times()
+    else:
+        results = run_benchmarks(args.scales, args.rate, args.seed)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.imports and not all(result['within_budget'] for result in results):
+        sys.exit(1)
+    if not args.imports and not all(result.get('valid', True) for result in results):
+        sys.exit(1)
@@ -0,0 +1,171 @@
+import os
+import json
+import datetime
+import numpy as np
+import align
+import intervals
+import key_index
+import s3_fetch
+import correct_drift
+import schema
+
+IMU_BUCKET = 'matt3r-imu-us-west-2'
+ACC_COLUMNS = ['lr_acc(m/s^2)', 'bf_acc(m/s^2)', 'vert_acc(m/s^2)']
+# calibrations are stored as <CALIBRATION_DIR>/<org>/<k3y>.json
+CALIBRATION_DIR = os.environ.get('IMU_CALIBRATION_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'imu_validation_calibration'))
+# a calibration stays valid for this long after the last sample it was computed from
+VALIDITY_EXTENSION = 30 * 86400
+# rolling window used to find still periods and the largest summed per-axis variance allowed in one
+STILL_WINDOW = 2.0
+STILL_VARIANCE = 0.01
+# still periods shorter than this are not used for the gravity estimate
+MIN_STILL_DURATION = 10.0
+
+# rotation matrix turning the unit vector v1 onto the unit vector v2
+def rotate_align(v1, v2):
+    axis = np.cross(v1, v2)
+    cosA = np.dot(v1, v2)
+    if np.isclose(cosA, -1.0):
+        # opposite vectors, turn half way round any axis perpendicular to v1
+        perpendicular = np.cross(v1, [1.0, 0.0, 0.0])
+        if np.linalg.norm(perpendicular) < 1e-6:
+            perpendicular = np.cross(v1, [0.0, 1.0, 0.0])
+        perpendicular = perpendicular / np.linalg.norm(perpendicular)
+        return 2 * np.outer(perpendicular, perpendicular) - np.eye(3)
+    k = 1 / (1 + cosA)
+    return np.array([[(axis[0] * axis[0] * k) + cosA, (axis[1] * axis[0] * k) - axis[2], (axis[2] * axis[0] * k) + axis[1]],
+                     [(axis[0] * axis[1] * k) + axis[2], (axis[1] * axis[1] * k) + cosA, (axis[2] * axis[1] * k) - axis[0]],
+                     [(axis[0] * axis[2] * k) - axis[1], (axis[1] * axis[2] * k) + axis[0], (axis[2] * axis[2] * k) + cosA]])
+
+# rotation matrix aligning the measured gravity direction with the vertical axis
+def get_rot_matrix(acc):
+    acc_dir = acc / np.linalg.norm(acc)
+    return rotate_align(acc_dir, np.array([0, 0, 1]))
+
+# variance of each axis over a trailing window of samples, from cumulative sums in one vectorized pass
+def rolling_variance(values, window):
+    values = values - values.mean(axis=0)
+    zero = np.zeros((1, values.shape[1]))
+    sums = np.concatenate((zero, np.cumsum(values, axis=0)))
+    sums_sq = np.concatenate((zero, np.cumsum(values**2, axis=0)))
+    window = max(1, min(window, len(values)))
+    index = np.arange(1, len(values) + 1)
+    start = np.maximum(index - window, 0)
+    count = (index - start)[:, None]
+    mean = (sums[index] - sums[start]) / count
+    return np.maximum((sums_sq[index] - sums_sq[start]) / count - mean**2, 0)
+
+# mask of the samples the device reports as stationary that are also still in the raw signal
+def still_mask(times, acc_values, time_df, time_column='imu_sw_clock(epoch)', window=STILL_WINDOW,
+               max_variance=STILL_VARIANCE, rate=None):
+    # each infer row's motion state holds until the next row
+    infer_times = time_df[time_column].to_numpy(dtype=np.float64)
+    stationary = ~schema.is_moving(time_df['motion_state'])
+    order = np.argsort(infer_times, kind='stable')
+    infer_times = infer_times[order]
+    stationary = stationary[order]
+    state = intervals.interval_index(times, infer_times[:-1], infer_times[1:], closed='left')
+    reported = (state >= 0) & stationary[np.clip(state, 0, None)]
+
+    if rate is None:
+        rate = 1 / np.median(np.diff(times)) if len(times) > 1 else 1.0
+    window_samples = int(round(window * rate))
+    # a sample is still when the whole trailing window around it is quiet
+    quiet = rolling_variance(acc_values, window_samples).sum(axis=1) < max_variance
+    return reported & quiet
+
+# estimate gravity from the still periods, robust to a few periods where the vehicle was not level
+def estimate_gravity(times, acc_values, mask, min_duration=MIN_STILL_DURATION):
+    # split the mask into contiguous still runs
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    long_runs = (times[run_ends - 1] - times[run_starts]) >= min_duration if len(run_starts) else np.array([], dtype=bool)
+    run_starts = run_starts[long_runs]
+    run_ends = run_ends[long_runs]
+    if len(run_starts) == 0:
+        return None, 0
+
+    # mean of each run from cumulative sums, then the median across runs
+    sums = np.concatenate((np.zeros((1, 3)), np.cumsum(acc_values, axis=0)))
+    run_means = (sums[run_ends] - sums[run_starts]) / (run_ends - run_starts)[:, None]
+    return np.median(run_means, axis=0), len(run_starts)
+
+# compute the mounting rotation of a device from raw accel and infer data
+def calibrate(acc_df, time_df, time_column=None):
+    if time_column is None:
+        time_column = align.imu_time_column(acc_df)
+    infer_column = 'system_clock(epoch)' if time_column == 'correct_timestamp' else 'imu_sw_clock(epoch)'
+    times, acc_values = align.sorted_arrays(acc_df, time_column, ACC_COLUMNS)
+    acc_values = acc_values.astype(np.float64)
+
+    mask = still_mask(times, acc_values, time_df, infer_column)
+    gravity, n_windows = estimate_gravity(times, acc_values, mask)
+    if gravity is None:
+        raise ValueError('no stationary period long enough to calibrate the device')
+
+    return {'valid_from': float(times[0]),
+            'valid_to': float(times[-1]) + VALIDITY_EXTENSION,
+            'gravity': gravity.tolist(),
+            'g': float(np.linalg.norm(gravity)),
+            'rotation': get_rot_matrix(gravity).tolist(),
+            'n_windows': int(n_windows),
+            'n_samples': int(mask.sum())}
+
+def _calibration_path(organization_id, k3y_id):
+    return os.path.join(CALIBRATION_DIR, organization_id, k3y_id + '.json')
+
+def load_calibrations(organization_id, k3y_id):
+    try:
+        with open(_calibration_path(organization_id, k3y_id)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return []
+
+# store a calibration, replacing any stored one starting at the same time
+def save_calibration(organization_id, k3y_id, calibration):
+    calibrations = [entry for entry in load_calibrations(organization_id, k3y_id)
+                    if entry['valid_from'] != calibration['valid_from']]
+    calibrations.append(calibration)
+    calibrations.sort(key=lambda entry: entry['valid_from'])
+    path = _calibration_path(organization_id, k3y_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(calibrations, file, indent=2)
+    os.replace(tmp_path, path)
+
+# the most recent stored calibration valid at the timestamp, or None
+def find_calibration(organization_id, k3y_id, timestamp):
+    valid = [entry for entry in load_calibrations(organization_id, k3y_id)
+             if entry['valid_from'] <= timestamp <= entry['valid_to']]
+    if not valid:
+        return None
+    return max(valid, key=lambda entry: entry['valid_from'])
+
+# the raw accel data of a date range, calibration needs no gyro data
+def fetch_raw_accel(k3y_id, organization_id, start_date, end_date):
+    keys, etags = key_index.find_keys(IMU_BUCKET, organization_id + '/' + 'k3y-' + k3y_id + '/accel/', 'raw_date', start_date, end_date)
+    acc_df = s3_fetch.fetch_parquet(IMU_BUCKET, keys, etags=etags, stream='accel')
+    acc_df.dropna(inplace=True)
+    acc_df.reset_index(drop=True, inplace=True)
+    return acc_df
+
+# the stored calibration of a device covering a date range, calibrating from the raw data and storing the result
+# only when none covers it; 'rotation' and 'g' are what ahrs_engine.imu_k3y_to_vehicle uses for the device
+def get_calibration(organization_id, k3y_id, start_date_str, end_date_str):
+    start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
+    end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
+    start_time = start_date.replace(tzinfo=datetime.timezone.utc).timestamp()
+    calibration = find_calibration(organization_id, k3y_id, start_time)
+    if calibration is None:
+        acc_df = fetch_raw_accel(k3y_id, organization_id, start_date, end_date)
+        time_df = correct_drift.fetch_time_data(k3y_id, organization_id, start_date, end_date, compact=True)
+        calibration = calibrate(acc_df, time_df)
+        # the first sample can come after midnight, start the validity at the requested date so the next
+        # lookup of the same range finds this entry instead of calibrating again
+        calibration['valid_from'] = min(calibration['valid_from'], start_time)
+        save_calibration(organization_id, k3y_id, calibration)
+    calibration = dict(calibration)
+    calibration['rotation'] = np.array(calibration['rotation'])
+    return calibration
@@ -1,100 +1,112 @@
-import boto3
 import numpy as np
 import datetime
-import pandas as pd
-from io import BytesIO
+import s3_fetch
+import key_index
+import tracing
 
 IMU_BUCKET = 'matt3r-imu-us-west-2'
-s3_client = boto3.client('s3')
-
-def fetch_imu_data(imu_k3y_id, organization_id, start_date, end_date):
-    # get a list of all parquet files in the prefix and filter them to within the date range
-    response = s3_client.list_objects_v2(Bucket=IMU_BUCKET, Prefix=organization_id + '/' + 'k3y-' + imu_k3y_id + '/accel/')
-    all_keys = [item['Key'] for item in response.get('Contents', [])]
-
-    while response['IsTruncated']:
-        response = s3_client.list_objects_v2(Bucket=IMU_BUCKET, Prefix=organization_id + '/' + 'k3y-' + imu_k3y_id + '/accel/', ContinuationToken=response['NextContinuationToken'])
-        all_keys.extend([item['Key'] for item in response.get('Contents', [])])
-
-    keys = [file for file in all_keys if file.split('.')[-1] == 'parquet'
-            and len(file.split('/')[-1].split('_')[0]) == 10
-            and datetime.datetime.strptime(file.split('/')[-1].split('_')[0], '%Y-%m-%d') >= start_date
-            and datetime.datetime.strptime(file.split('/')[-1].split('_')[0], '%Y-%m-%d') <= end_date]
-    keys = sorted(keys, key=lambda x: x.split('/')[-1].split('.')[0])
-
-    # retrieve and combine filtered perquet files
-    df_list = []
-    for key in keys:
-        response = s3_client.get_object(Bucket=IMU_BUCKET, Key=key)
-        buffer = BytesIO(response['Body'].read())
-        imu_df = pd.read_parquet(buffer, engine='pyarrow')
-        df_list.append(imu_df)
-    imu_df = pd.concat(df_list, axis=0, ignore_index=True)
+
+# the frames keep every column of the files unless compact, which reads only the columns of schema.COLUMNS
+# in their compact dtypes
+def fetch_imu_data(imu_k3y_id, organization_id, start_date, end_date, compact=False):
+    # look up the parquet files in the prefix within the date range
+    keys, etags = key_index.find_keys(IMU_BUCKET, organization_id + '/' + 'k3y-' + imu_k3y_id + '/accel/', 'date_prefix', start_date, end_date)
+
+    # retrieve and combine filtered parquet files
+    imu_df = s3_fetch.fetch_parquet(IMU_BUCKET, keys, etags=etags, stream='accel' if compact else None)
 
     return imu_df
 
-def fetch_time_data(imu_k3y_id, organization_id, start_date, end_date):
+def fetch_time_data(imu_k3y_id, organization_id, start_date, end_date, compact=False):
     # create a 1 day buffer to capture any data on the boundaries
     start_date = start_date - datetime.timedelta(days=1)
     end_date = end_date + datetime.timedelta(days=1)
-    # get a list of all parquet files in the prefix and filter them to within the date range
-    response = s3_client.list_objects(Bucket=IMU_BUCKET, Prefix=organization_id + '/' + 'k3y-' + imu_k3y_id + '/infer/')
-    all_keys = [item['Key'] for item in response['Contents']]
-    keys = [file for file in all_keys if file.split('.')[-1] == 'parquet'
-            and len(file.split('/')[-1].split('.')[0]) != 10
-            and datetime.datetime.strptime(file.split('/')[-1].split('.')[0].split('_')[-1], '%Y-%m-%d') >= start_date
-            and datetime.datetime.strptime(file.split('/')[-1].split('.')[0].split('_')[-1], '%Y-%m-%d') <= end_date]
-    keys = sorted(keys, key=lambda x: x.split('/')[-1].split('.')[0])
-
-    # retrieve and combine filtered perquet files
-    df_list = []
-    for key in keys:
-        response = s3_client.get_object(Bucket=IMU_BUCKET, Key=key)
-        buffer = BytesIO(response['Body'].read())
-        time_df = pd.read_parquet(buffer, engine='pyarrow')
-        df_list.append(time_df)
-    time_df = pd.concat(df_list, axis=0, ignore_index=True)
-
-    # drop any nan values
+    # look up the parquet files in the prefix within the date range
+    keys, etags = key_index.find_keys(IMU_BUCKET, organization_id + '/' + 'k3y-' + imu_k3y_id + '/infer/', 'date_suffix', start_date, end_date)
+
+    # retrieve and combine filtered parquet files
+    time_df = s3_fetch.fetch_parquet(IMU_BUCKET, keys, etags=etags, stream='infer' if compact else None)
+
+    return clean_time_data(time_df)
+
+# drop the infer rows missing any of the clock columns
+def clean_time_data(time_df):
     time_df.dropna(subset=['diff_sw_sys(second)', 'imu_sw_clock(epoch)', 'system_clock(epoch)'], inplace=True)
     time_df.reset_index(drop=True, inplace=True)
-
     return time_df
 
-def shift_time(imu_df, time_df):
+# fit a linear drift model to each segment between clock jumps
+@tracing.traced()
+def fit_segments(time_df, jump_limit=3):
+    import pandas as pd
     # identify any jumps in the data
-    jump_limit = 3
     jump_indexes = time_df[abs(time_df['diff_sw_sys(second)'].diff()) > jump_limit].index
     jump_indexes = jump_indexes.append(pd.Index([time_df.index[-1]]))
 
-    # create a list of the slope segments
+    # create a table of the slope segments
+    sw_clock = time_df['imu_sw_clock(epoch)'].to_numpy()
+    sys_clock = time_df['system_clock(epoch)'].to_numpy()
+    diff = time_df['diff_sw_sys(second)'].to_numpy()
     segments = []
     index_start = 0
     for index in jump_indexes:
         seg_data = {}
-        seg_data['start_timestamp'] = time_df['imu_sw_clock(epoch)'].iloc[index_start]
-        seg_data['end_timestamp'] = time_df['imu_sw_clock(epoch)'].iloc[index]
-        seg_data['slope'], seg_data['intercept'] = np.polyfit(time_df['system_clock(epoch)'][index_start:index], 
-                                                            time_df['diff_sw_sys(second)'][index_start:index], 1)
+        seg_data['start_timestamp'] = sw_clock[index_start]
+        seg_data['end_timestamp'] = sw_clock[index]
+        seg_data['slope'], seg_data['intercept'] = np.polyfit(sys_clock[index_start:index], diff[index_start:index], 1)
         seg_data['offset'] = seg_data['slope'] * seg_data['start_timestamp'] + seg_data['intercept']
         segments.append(seg_data)
         index_start = index
 
-    for seg in segments:
-        imu_df_seg = imu_df[(imu_df['timestamp(epoch in sec)'] >= seg['start_timestamp'])
-                            & (imu_df['timestamp(epoch in sec)'] < seg['end_timestamp'])]
-        imu_df.loc[imu_df_seg.index, 'correct_timestamp'] = imu_df_seg['timestamp(epoch in sec)'].apply(
-            lambda x: x - (x - seg['start_timestamp']) * seg['slope'] - seg['offset'])
-
-    # drop any nan values
-    imu_df.dropna(inplace=True)
+    return pd.DataFrame(segments, columns=['start_timestamp', 'end_timestamp', 'slope', 'intercept', 'offset'])
+
+# compute the corrected time for each raw timestamp, nan where no segment covers it
+def correct_timestamps(timestamps, segments):
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    starts = segments['start_timestamp'].to_numpy()
+    ends = segments['end_timestamp'].to_numpy()
+    slopes = segments['slope'].to_numpy()
+    offsets = segments['offset'].to_numpy()
+    corrected = np.full(timestamps.shape, np.nan)
+    if len(segments) == 0:
+        return corrected
+
+    if np.all(np.diff(starts) >= 0):
+        # assign every sample to its segment with one search over the segment boundaries
+        seg = np.searchsorted(starts, timestamps, side='right') - 1
+        seg_clip = np.clip(seg, 0, None)
+        valid = (seg >= 0) & (timestamps < ends[seg_clip])
+        seg = seg_clip[valid]
+        ts = timestamps[valid]
+        corrected[valid] = ts - (ts - starts[seg]) * slopes[seg] - offsets[seg]
+    else:
+        # the clock stepped backwards, so fall back to masking each segment in order
+        for start, end, slope, offset in zip(starts, ends, slopes, offsets):
+            valid = (timestamps >= start) & (timestamps < end)
+            ts = timestamps[valid]
+            corrected[valid] = ts - (ts - start) * slope - offset
+
+    return corrected
+
+# write the corrected time onto the imu data and drop samples outside every segment
+def apply_segments(imu_df, segments):
+    imu_df['correct_timestamp'] = correct_timestamps(imu_df['timestamp(epoch in sec)'].to_numpy(), segments)
+
+    # drop any nan values, only copying the frame when there is something to drop
+    if imu_df.isna().to_numpy().any():
+        imu_df.dropna(inplace=True)
     imu_df.reset_index(drop=True, inplace=True)
 
     return imu_df
 
-def correct_clock(imu_k3y_id, organization_id, start_date_str, end_date_str):
+@tracing.traced()
+def shift_time(imu_df, time_df, jump_limit=3):
+    segments = fit_segments(time_df, jump_limit)
+    return apply_segments(imu_df, segments)
+
+def correct_clock(imu_k3y_id, organization_id, start_date_str, end_date_str, compact=False):
     start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
-    imu_df = fetch_imu_data(imu_k3y_id, organization_id, start_date, end_date)
-    time_df = fetch_time_data(imu_k3y_id, organization_id, start_date, end_date)
+    imu_df = fetch_imu_data(imu_k3y_id, organization_id, start_date, end_date, compact)
+    time_df = fetch_time_data(imu_k3y_id, organization_id, start_date, end_date, compact)
     return shift_time(imu_df, time_df)
\ No newline at end of file
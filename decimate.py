@@ -0,0 +1,75 @@
+import numpy as np
+
+# samples per bin at the finest level of the pyramid, ranges with fewer than BASE_BIN samples per requested bin
+# are returned raw
+BASE_BIN = 16
+
+# min/max decimation pyramid over a series sorted by x: level l stores, for every bin of BASE_BIN * 2**l samples,
+# the index of its smallest and largest value, so the envelope of any range can be read at roughly the
+# requested number of bins without touching the samples inside them
+class Pyramid:
+    def __init__(self, x, y, base_bin=BASE_BIN):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        keep = ~(np.isnan(x) | np.isnan(y))
+        if not keep.all():
+            x = x[keep]
+            y = y[keep]
+        if len(x) > 1 and np.any(np.diff(x) < 0):
+            order = np.argsort(x, kind='stable')
+            x = x[order]
+            y = y[order]
+        self.x = x
+        self.y = y
+        self.base_bin = base_bin
+        self.min_levels = []
+        self.max_levels = []
+        if len(y) == 0:
+            return
+
+        # the finest level reduces each block of base_bin samples, padding the last block
+        n_bins = -(-len(y) // base_bin)
+        pad = n_bins * base_bin - len(y)
+        offsets = np.arange(n_bins) * base_bin
+        min_idx = np.concatenate((y, np.full(pad, np.inf))).reshape(n_bins, base_bin).argmin(axis=1) + offsets
+        max_idx = np.concatenate((y, np.full(pad, -np.inf))).reshape(n_bins, base_bin).argmax(axis=1) + offsets
+        self.min_levels.append(min_idx)
+        self.max_levels.append(max_idx)
+
+        # every coarser level merges pairs of bins from the level below
+        while len(min_idx) > 1:
+            min_idx = self._merge(min_idx, np.less)
+            max_idx = self._merge(max_idx, np.greater)
+            self.min_levels.append(min_idx)
+            self.max_levels.append(max_idx)
+
+    def _merge(self, idx, better):
+        if len(idx) % 2:
+            idx = np.append(idx, idx[-1])
+        pairs = idx.reshape(-1, 2)
+        take_right = better(self.y[pairs[:, 1]], self.y[pairs[:, 0]])
+        return pairs[np.arange(len(pairs)), take_right.astype(np.int64)]
+
+    def __len__(self):
+        return len(self.x)
+
+    # return (x, y_min, y_max) for the samples with x0 <= x <= x1, as raw samples (y_min == y_max) when the range
+    # holds few enough of them, otherwise as between n_bins and 2 * n_bins bins centred on their x extent
+    def window(self, x0, x1, n_bins):
+        lo = np.searchsorted(self.x, x0, side='left')
+        hi = np.searchsorted(self.x, x1, side='right')
+        count = hi - lo
+        n_bins = max(int(n_bins), 1)
+        if count <= self.base_bin * n_bins:
+            y = self.y[lo:hi]
+            return self.x[lo:hi], y, y
+
+        # the coarsest level that still gives at least n_bins bins over the range
+        level = min(int(np.log2(count / (self.base_bin * n_bins))), len(self.min_levels) - 1)
+        size = self.base_bin << level
+        first = lo // size
+        last = (hi - 1) // size + 1
+        starts = np.arange(first, last) * size
+        ends = np.minimum(starts + size, len(self.x)) - 1
+        x = (self.x[starts] + self.x[ends]) / 2
+        return x, self.y[self.min_levels[level][first:last]], self.y[self.max_levels[level][first:last]]
@@ -0,0 +1,144 @@
+import json
+import datetime
+import numpy as np
+import pandas as pd
+import s3_fetch
+import key_index
+import correct_drift
+
+IMU_BUCKET = 'matt3r-imu-us-west-2'
+TIME_COLUMNS = ['imu_sw_clock(epoch)', 'system_clock(epoch)', 'diff_sw_sys(second)']
+
+# running least squares fit of diff_sw_sys(second) against system_clock(epoch) for each clock segment,
+# a new segment starts whenever the clock difference jumps by more than jump_limit seconds
+class DriftModel:
+    def __init__(self, jump_limit=3):
+        self.jump_limit = jump_limit
+        # fitted segments that were closed by a jump
+        self.closed = []
+        # sufficient statistics of the open segment: sample count, means and centred second moments
+        self.current = None
+        # the newest row is only added to the fit once the next row shows it does not start a new segment
+        self.pending = None
+
+    # add new infer rows, which must come after every row already seen
+    def update(self, time_df):
+        time_df = time_df.dropna(subset=TIME_COLUMNS)
+        sw_clock = time_df['imu_sw_clock(epoch)'].to_numpy(dtype=np.float64)
+        sys_clock = time_df['system_clock(epoch)'].to_numpy(dtype=np.float64)
+        diff = time_df['diff_sw_sys(second)'].to_numpy(dtype=np.float64)
+        if len(sw_clock) == 0:
+            return self
+        if self.pending is not None:
+            sw_clock = np.concatenate(([self.pending[0]], sw_clock))
+            sys_clock = np.concatenate(([self.pending[1]], sys_clock))
+            diff = np.concatenate(([self.pending[2]], diff))
+        if self.current is None:
+            self.current = _new_segment(sw_clock[0])
+
+        # identify any jumps in the data
+        jump_indexes = np.flatnonzero(np.abs(np.diff(diff)) > self.jump_limit) + 1
+
+        index_start = 0
+        for index in jump_indexes:
+            _add_rows(self.current, sys_clock[index_start:index], diff[index_start:index])
+            self.closed.append(_fit(self.current, sw_clock[index]))
+            self.current = _new_segment(sw_clock[index])
+            index_start = index
+        _add_rows(self.current, sys_clock[index_start:-1], diff[index_start:-1])
+        self.pending = (float(sw_clock[-1]), float(sys_clock[-1]), float(diff[-1]))
+
+        return self
+
+    # the newest imu software clock time seen so far
+    @property
+    def last_timestamp(self):
+        return None if self.pending is None else self.pending[0]
+
+    # the fitted segments in the same form as correct_drift.fit_segments
+    def segments(self):
+        segments = list(self.closed)
+        if self.current is not None and self.current['n'] > 0:
+            segments.append(_fit(self.current, self.pending[0]))
+        return pd.DataFrame(segments, columns=['start_timestamp', 'end_timestamp', 'slope', 'intercept', 'offset'])
+
+    # correct the imu timestamps with the current fit
+    def shift_time(self, imu_df):
+        return correct_drift.apply_segments(imu_df, self.segments())
+
+    def to_dict(self):
+        return {'jump_limit': self.jump_limit,
+                'closed': self.closed,
+                'current': self.current,
+                'pending': self.pending}
+
+    @classmethod
+    def from_dict(cls, state):
+        model = cls(state['jump_limit'])
+        model.closed = state['closed']
+        model.current = state['current']
+        model.pending = None if state['pending'] is None else tuple(state['pending'])
+        return model
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            return cls.from_dict(json.load(file))
+
+def _new_segment(start_timestamp):
+    return {'start_timestamp': float(start_timestamp), 'n': 0, 'mean_x': 0.0, 'mean_y': 0.0, 'm_xx': 0.0, 'c_xy': 0.0}
+
+# merge a batch of rows into the running statistics without forming large raw sums
+def _add_rows(seg, x, y):
+    n_b = len(x)
+    if n_b == 0:
+        return
+    mean_xb = x.mean()
+    mean_yb = y.mean()
+    m_xxb = ((x - mean_xb)**2).sum()
+    c_xyb = ((x - mean_xb) * (y - mean_yb)).sum()
+
+    n_a = seg['n']
+    n = n_a + n_b
+    dx = mean_xb - seg['mean_x']
+    dy = mean_yb - seg['mean_y']
+    seg['mean_x'] = float(seg['mean_x'] + dx * n_b / n)
+    seg['mean_y'] = float(seg['mean_y'] + dy * n_b / n)
+    seg['m_xx'] = float(seg['m_xx'] + m_xxb + dx * dx * n_a * n_b / n)
+    seg['c_xy'] = float(seg['c_xy'] + c_xyb + dx * dy * n_a * n_b / n)
+    seg['n'] = n
+
+# least squares line of a segment, a segment with a single distinct time gets a flat line
+def _fit(seg, end_timestamp):
+    if seg['m_xx'] > 0:
+        slope = seg['c_xy'] / seg['m_xx']
+    else:
+        slope = 0.0
+    intercept = seg['mean_y'] - slope * seg['mean_x']
+    return {'start_timestamp': seg['start_timestamp'],
+            'end_timestamp': float(end_timestamp),
+            'slope': slope,
+            'intercept': intercept,
+            'offset': slope * seg['start_timestamp'] + intercept}
+
+# feed the infer rows newer than the model's last row into it, re-reading from the day before that row
+def update_drift_model(model, imu_k3y_id, organization_id, start_date, end_date):
+    last_timestamp = model.last_timestamp
+    if last_timestamp is not None:
+        last_time = datetime.datetime.fromtimestamp(last_timestamp, datetime.timezone.utc).replace(tzinfo=None)
+        last_date = datetime.datetime.combine(last_time.date(), datetime.time.min)
+        start_date = max(start_date, last_date - datetime.timedelta(days=1))
+
+    prefix = organization_id + '/' + 'k3y-' + imu_k3y_id + '/infer/'
+    keys, etags = key_index.find_keys(IMU_BUCKET, prefix, 'date_suffix', start_date, end_date)
+    if not keys:
+        return model
+    time_df = s3_fetch.fetch_parquet(IMU_BUCKET, keys, etags=etags, stream='infer')
+    if last_timestamp is not None:
+        time_df = time_df[time_df['imu_sw_clock(epoch)'] > last_timestamp]
+
+    return model.update(time_df)
@@ -1,47 +1,36 @@
-import boto3
-import json
 import datetime
-import pandas as pd
-from io import BytesIO
+import s3_fetch
+import key_index
 import correct_drift
-import importlib
-importlib.reload(correct_drift)
 
 CANSERVER_PARSED_BUCKET = 'matt3r-canserver-us-west-2'
 CANSERVER_EVENT_BUCKET = 'matt3r-canserver-event-us-west-2'
 IMU_BUCKET = 'matt3r-imu-us-west-2'
-s3_client = boto3.client('s3')
 
-def get_imu_data(k3y_id, org_id, start_date_str, end_date_str, correct_time=True):
+# the frames keep every column of the files unless compact, which reads only the columns of schema.COLUMNS
+# as float32 axes and a categorical motion_state
+def get_imu_data(k3y_id, org_id, start_date_str, end_date_str, correct_time=True, compact=False):
     if correct_time:
-        return correct_drift.correct_clock(k3y_id, org_id, start_date_str, end_date_str)
+        return correct_drift.correct_clock(k3y_id, org_id, start_date_str, end_date_str, compact)
     else:
         start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
         end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
-        return correct_drift.fetch_imu_data(k3y_id, org_id, start_date, end_date)
+        return correct_drift.fetch_imu_data(k3y_id, org_id, start_date, end_date, compact)
     
-def get_time_data(k3y_id, org_id, start_date_str, end_date_str):
+def get_time_data(k3y_id, org_id, start_date_str, end_date_str, compact=False):
     start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
-    return correct_drift.fetch_time_data(k3y_id, org_id, start_date, end_date)
+    return correct_drift.fetch_time_data(k3y_id, org_id, start_date, end_date, compact)
 
 def get_events(k3y_id, org_id, start_date_str, end_date_str):
     start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
-    # get a list of all json files in the prefix and filter them to within the date range
-    response = s3_client.list_objects(Bucket=CANSERVER_EVENT_BUCKET, Prefix=org_id + '/' + 'k3y-' + k3y_id + '/')
-    all_keys = [item['Key'] for item in response['Contents']]
-    keys = [file for file in all_keys if file.split('.')[-1] == 'json'
-            and len(file.split('/')[-1]) == 15
-            and datetime.datetime.strptime(file.split('/')[-1].split('.')[0], '%Y-%m-%d') >= start_date
-            and datetime.datetime.strptime(file.split('/')[-1].split('.')[0], '%Y-%m-%d') <= end_date]
-    keys = sorted(keys, key=lambda x: x.split('/')[-1].split('.')[0])
+    # look up the json files in the prefix within the date range
+    keys, etags = key_index.find_keys(CANSERVER_EVENT_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/', 'date_json', start_date, end_date)
 
     # retrieve and combine filtered json files
     event_dict = {}
-    for key in keys:
-        response = s3_client.get_object(Bucket=CANSERVER_EVENT_BUCKET, Key=key)
-        result = json.loads(response["Body"].read().decode())
+    for result in s3_fetch.fetch_objects(CANSERVER_EVENT_BUCKET, keys, s3_fetch.read_json, etags=etags):
         for index in result['imu_telematics']:
             if index in event_dict:
                 event_dict[index].extend(result['imu_telematics'][index])
@@ -50,76 +39,36 @@ def get_events(k3y_id, org_id, start_date_str, end_date_str):
 
     return event_dict
 
-def get_can_data(k3y_id, org_id, start_date_str, end_date_str):
+def get_can_data(k3y_id, org_id, start_date_str, end_date_str, compact=False):
     start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
-    # get a list of all parquet files in the prefix and filter them to within the date range
-    response = s3_client.list_objects_v2(Bucket=CANSERVER_PARSED_BUCKET, Prefix=org_id + '/' + 'k3y-' + k3y_id + '/')
-    all_keys = [item['Key'] for item in response.get('Contents', [])]
-
-    while response['IsTruncated']:
-        response = s3_client.list_objects_v2(Bucket=CANSERVER_PARSED_BUCKET, Prefix=org_id + '/' + 'k3y-' + k3y_id + '/', ContinuationToken=response['NextContinuationToken'])
-        all_keys.extend([item['Key'] for item in response.get('Contents', [])])
-
-    keys = [file for file in all_keys if file.split('.')[-1] == 'parquet'
-            and datetime.datetime.strptime(file.split('/')[-1].split('_')[0], '%Y-%m-%d') >= start_date
-            and datetime.datetime.strptime(file.split('/')[-1].split('_')[0], '%Y-%m-%d') <= end_date]
-    keys = sorted(keys, key=lambda x: x.split('/')[-1].split('.')[0])
-
-    # retrieve and combine filtered perquet files
-    df_list = []
-    for key in keys:
-        response = s3_client.get_object(Bucket=CANSERVER_PARSED_BUCKET, Key=key)
-        buffer = BytesIO(response['Body'].read())
-        can_df = pd.read_parquet(buffer, engine='pyarrow')
-        df_list.append(can_df)
-    can_df = pd.concat(df_list, axis=0, ignore_index=True)
+    # look up the parquet files in the prefix within the date range
+    keys, etags = key_index.find_keys(CANSERVER_PARSED_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/', 'date_prefix', start_date, end_date)
+
+    # retrieve and combine filtered parquet files
+    can_df = s3_fetch.fetch_parquet(CANSERVER_PARSED_BUCKET, keys, etags=etags, stream='can' if compact else None)
 
     return can_df
 
-def get_raw_data(k3y_id, org_id, start_date_str, end_date_str, time_correction=False):
+def get_raw_data(k3y_id, org_id, start_date_str, end_date_str, time_correction=False, compact=False):
 
     start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
 
-    # get a list of all accel parquet files in the prefix and filter them to within the date range
-    response = s3_client.list_objects(Bucket=IMU_BUCKET, Prefix=org_id + '/' + 'k3y-' + k3y_id + '/accel/')
-    all_keys = [item['Key'] for item in response['Contents']]
-    keys = [file for file in all_keys if file.split('.')[-1] == 'parquet'
-            and len(file.split('/')[-1].split('_')[1]) == 10
-            and datetime.datetime.strptime(file.split('/')[-1].split('_')[1], '%Y-%m-%d') >= start_date
-            and datetime.datetime.strptime(file.split('/')[-1].split('_')[1], '%Y-%m-%d') <= end_date]
-    keys = sorted(keys, key=lambda x: x.split('/')[-1].split('.')[0])
-
-    # retrieve and combine filtered perquet files
-    df_list = []
-    for key in keys:
-        response = s3_client.get_object(Bucket=IMU_BUCKET, Key=key)
-        buffer = BytesIO(response['Body'].read())
-        acc_df = pd.read_parquet(buffer, engine='pyarrow')
-        df_list.append(acc_df)
-    acc_df = pd.concat(df_list, axis=0, ignore_index=True)
-
-    # get a list of all gyro parquet files in the prefix and filter them to within the date range
-    response = s3_client.list_objects(Bucket=IMU_BUCKET, Prefix=org_id + '/' + 'k3y-' + k3y_id + '/gyro/')
-    all_keys = [item['Key'] for item in response['Contents']]
-    keys = [file for file in all_keys if file.split('.')[-1] == 'parquet'
-            and len(file.split('/')[-1].split('_')[1]) == 10
-            and datetime.datetime.strptime(file.split('/')[-1].split('_')[1], '%Y-%m-%d') >= start_date
-            and datetime.datetime.strptime(file.split('/')[-1].split('_')[1], '%Y-%m-%d') <= end_date]
-    keys = sorted(keys, key=lambda x: x.split('/')[-1].split('.')[0])
+    # look up the accel parquet files in the prefix within the date range
+    keys, etags = key_index.find_keys(IMU_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/accel/', 'raw_date', start_date, end_date)
+
+    # retrieve and combine filtered parquet files
+    acc_df = s3_fetch.fetch_parquet(IMU_BUCKET, keys, etags=etags, stream='accel' if compact else None)
+
+    # look up the gyro parquet files in the prefix within the date range
+    keys, etags = key_index.find_keys(IMU_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/gyro/', 'raw_date', start_date, end_date)
 
     # retrieve and combine filtered parquet files
-    df_list = []
-    for key in keys:
-        response = s3_client.get_object(Bucket=IMU_BUCKET, Key=key)
-        buffer = BytesIO(response['Body'].read())
-        gyro_df = pd.read_parquet(buffer, engine='pyarrow')
-        df_list.append(gyro_df)
-    gyro_df = pd.concat(df_list, axis=0, ignore_index=True)
+    gyro_df = s3_fetch.fetch_parquet(IMU_BUCKET, keys, etags=etags, stream='gyro' if compact else None)
 
     if time_correction:
-        time_df = correct_drift.fetch_time_data(k3y_id, org_id, start_date, end_date)
+        time_df = correct_drift.fetch_time_data(k3y_id, org_id, start_date, end_date, compact)
         acc_df = correct_drift.shift_time(acc_df, time_df)
         gyro_df = correct_drift.shift_time(gyro_df, time_df)
 
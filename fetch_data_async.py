@@ -0,0 +1,170 @@
+import asyncio
+import datetime
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import s3_fetch
+import s3_cache
+import key_index
+import correct_drift
+
+CANSERVER_PARSED_BUCKET = 'matt3r-canserver-us-west-2'
+CANSERVER_EVENT_BUCKET = 'matt3r-canserver-event-us-west-2'
+IMU_BUCKET = 'matt3r-imu-us-west-2'
+
+# downloads in flight at once across every stream being loaded, the rest of the connection pool is left for listings
+MAX_DOWNLOADS = s3_fetch.MAX_POOL_CONNECTIONS // 2
+# listings and downloads block on the network, so they get their own threads and never wait behind parsing
+_io_executor = ThreadPoolExecutor(max_workers=s3_fetch.MAX_POOL_CONNECTIONS, thread_name_prefix='s3_io')
+_semaphores = weakref.WeakKeyDictionary()
+
+# one download semaphore per event loop, a notebook kernel keeps a single loop but asyncio.run starts a new one
+def _download_slots():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(MAX_DOWNLOADS)
+    return semaphore
+
+def _run_io(func, *args, **kwargs):
+    return asyncio.get_running_loop().run_in_executor(_io_executor, functools.partial(func, *args, **kwargs))
+
+# parsing runs on the default executor, pyarrow releases the GIL while decoding
+def _run_cpu(func, *args, **kwargs):
+    return asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+async def _fetch(bucket, key, parse, etag):
+    async with _download_slots():
+        body, downloaded = await _run_io(s3_fetch.fetch_body, bucket, key, etag)
+    return await _run_cpu(parse, body), downloaded
+
+# look up and download the objects dated within the range, starting each download as soon as its key is known:
+# keys already in the persisted index start right away and newly listed keys start page by page while the
+# listing is still running, results come back in the same order as key_index.find_keys
+async def fetch_keys(bucket, prefix, scheme, start_date, end_date, parse):
+    loop = asyncio.get_running_loop()
+    parse_date = key_index.SCHEMES[scheme]
+    first_date, last_date = key_index.date_bounds(start_date, end_date)
+    tasks = {}
+
+    def start(key, etag):
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(_fetch(bucket, key, parse, etag))
+
+    def start_page(contents):
+        for item in contents:
+            date = parse_date(item['Key'].split('/')[-1])
+            if date is not None and first_date <= date <= last_date:
+                start(item['Key'], item['ETag'])
+
+    # pages arrive on a listing thread, hand them back to the loop in order
+    def on_page(contents):
+        loop.call_soon_threadsafe(start_page, contents)
+
+    # the saved ETags of known keys may be stale, find_keys leaves them out so each download checks its object
+    # with a HEAD request and never returns an overwritten object from the cache
+    known_keys, known_etags = await _run_io(key_index.find_keys, bucket, prefix, scheme, start_date, end_date, refresh=False)
+    for key in known_keys:
+        start(key, known_etags.get(key))
+
+    keys, etags = await _run_io(key_index.find_keys, bucket, prefix, scheme, start_date, end_date, on_page=on_page)
+    for key in keys:
+        start(key, etags.get(key))
+
+    # a key from the persisted index that is no longer listed was deleted, drop its download
+    stale = [task for key, task in tasks.items() if key not in etags]
+    for task in stale:
+        task.cancel()
+    await asyncio.gather(*stale, return_exceptions=True)
+
+    results = await asyncio.gather(*(tasks[key] for key in keys))
+    # keep the cache within its size limit after new objects were stored
+    if any(downloaded for _, downloaded in results):
+        await _run_io(s3_cache.evict)
+    return [result for result, _ in results]
+
+async def fetch_parquet(bucket, prefix, scheme, start_date, end_date):
+    import pandas as pd
+    df_list = await fetch_keys(bucket, prefix, scheme, start_date, end_date, s3_fetch.read_parquet)
+    return await _run_cpu(pd.concat, df_list, axis=0, ignore_index=True)
+
+def _parse_dates(start_date_str, end_date_str):
+    return datetime.datetime.strptime(start_date_str, '%Y-%m-%d'), datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
+
+async def _events(k3y_id, org_id, start_date, end_date):
+    results = await fetch_keys(CANSERVER_EVENT_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/', 'date_json',
+                               start_date, end_date, s3_fetch.read_json)
+    event_dict = {}
+    for result in results:
+        for index in result['imu_telematics']:
+            if index in event_dict:
+                event_dict[index].extend(result['imu_telematics'][index])
+            else:
+                event_dict[index] = result['imu_telematics'][index]
+    return event_dict
+
+async def _can_data(k3y_id, org_id, start_date, end_date):
+    return await fetch_parquet(CANSERVER_PARSED_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/', 'date_prefix', start_date, end_date)
+
+async def _time_data(k3y_id, org_id, start_date, end_date):
+    # create a 1 day buffer to capture any data on the boundaries
+    start_date = start_date - datetime.timedelta(days=1)
+    end_date = end_date + datetime.timedelta(days=1)
+    time_df = await fetch_parquet(IMU_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/infer/', 'date_suffix', start_date, end_date)
+    return await _run_cpu(correct_drift.clean_time_data, time_df)
+
+async def _raw_stream(k3y_id, org_id, stream, start_date, end_date):
+    return await fetch_parquet(IMU_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/' + stream + '/', 'raw_date', start_date, end_date)
+
+def _finish_raw(df, time_df):
+    if time_df is not None:
+        df = correct_drift.shift_time(df, time_df)
+    df.dropna(inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+async def _raw_data(k3y_id, org_id, start_date, end_date, time_correction):
+    streams = [_raw_stream(k3y_id, org_id, 'accel', start_date, end_date),
+               _raw_stream(k3y_id, org_id, 'gyro', start_date, end_date)]
+    if time_correction:
+        streams.append(_time_data(k3y_id, org_id, start_date, end_date))
+    acc_df, gyro_df, *time_df = await asyncio.gather(*streams)
+    time_df = time_df[0] if time_df else None
+    acc_df, gyro_df = await asyncio.gather(_run_cpu(_finish_raw, acc_df, time_df), _run_cpu(_finish_raw, gyro_df, time_df))
+    return acc_df, gyro_df
+
+# the same loaders as fetch_data, awaitable so a notebook cell can load several streams at once
+async def get_events(k3y_id, org_id, start_date_str, end_date_str):
+    return await _events(k3y_id, org_id, *_parse_dates(start_date_str, end_date_str))
+
+async def get_can_data(k3y_id, org_id, start_date_str, end_date_str):
+    return await _can_data(k3y_id, org_id, *_parse_dates(start_date_str, end_date_str))
+
+async def get_time_data(k3y_id, org_id, start_date_str, end_date_str):
+    return await _time_data(k3y_id, org_id, *_parse_dates(start_date_str, end_date_str))
+
+async def get_raw_data(k3y_id, org_id, start_date_str, end_date_str, time_correction=False):
+    return await _raw_data(k3y_id, org_id, *_parse_dates(start_date_str, end_date_str), time_correction)
+
+async def get_imu_data(k3y_id, org_id, start_date_str, end_date_str, correct_time=True):
+    start_date, end_date = _parse_dates(start_date_str, end_date_str)
+    imu = fetch_parquet(IMU_BUCKET, org_id + '/' + 'k3y-' + k3y_id + '/accel/', 'date_prefix', start_date, end_date)
+    if not correct_time:
+        return await imu
+    imu_df, time_df = await asyncio.gather(imu, _time_data(k3y_id, org_id, start_date, end_date))
+    return await _run_cpu(correct_drift.shift_time, imu_df, time_df)
+
+# load the accel, gyro, infer, CAN and event streams of a device concurrently,
+# e.g. data = await get_device_data('17700cf8', 'hamid', '2023-07-18', '2023-07-19')
+async def get_device_data(k3y_id, org_id, start_date_str, end_date_str, can_k3y_id=None, time_correction=False):
+    start_date, end_date = _parse_dates(start_date_str, end_date_str)
+    can_k3y_id = can_k3y_id or k3y_id
+    acc_df, gyro_df, time_df, can_df, event_dict = await asyncio.gather(
+        _raw_stream(k3y_id, org_id, 'accel', start_date, end_date),
+        _raw_stream(k3y_id, org_id, 'gyro', start_date, end_date),
+        _time_data(k3y_id, org_id, start_date, end_date),
+        _can_data(can_k3y_id, org_id, start_date, end_date),
+        _events(can_k3y_id, org_id, start_date, end_date))
+    shift_df = time_df if time_correction else None
+    acc_df, gyro_df = await asyncio.gather(_run_cpu(_finish_raw, acc_df, shift_df), _run_cpu(_finish_raw, gyro_df, shift_df))
+    return {'accel': acc_df, 'gyro': gyro_df, 'infer': time_df, 'can': can_df, 'events': event_dict}
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import s3_fetch
+import key_index
+import correct_drift
+import schema
+
+IMU_BUCKET = 'matt3r-imu-us-west-2'
+ACC_COLUMNS = ['lr_acc(m/s^2)', 'bf_acc(m/s^2)', 'vert_acc(m/s^2)']
+
+# yield the imu data one source file at a time, downloading the next file while the current one is processed
+def iter_imu_files(imu_k3y_id, organization_id, start_date, end_date, stream='accel', scheme='date_prefix'):
+    prefix = organization_id + '/' + 'k3y-' + imu_k3y_id + '/' + stream + '/'
+    keys, etags = key_index.find_keys(IMU_BUCKET, prefix, scheme, start_date, end_date)
+    if not keys:
+        return
+
+    parse = schema.parquet_reader(stream)
+
+    def fetch(key):
+        return s3_fetch.fetch_object(IMU_BUCKET, key, parse, etags.get(key))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetch, keys[0])
+        for key in keys[1:]:
+            chunk = future.result()
+            future = executor.submit(fetch, key)
+            yield chunk
+        yield future.result()
+
+# correct the clock of each chunk with segments fitted once over the whole range
+def correct_chunks(chunks, segments):
+    for chunk in chunks:
+        chunk = correct_drift.apply_segments(chunk, segments)
+        if len(chunk):
+            yield chunk
+
+# add the acceleration magnitude to each chunk
+def add_norm_acc(chunks):
+    for chunk in chunks:
+        acc = chunk[ACC_COLUMNS].to_numpy()
+        chunk['norm_acc'] = np.sqrt((acc**2).sum(axis=1))
+        yield chunk
+
+# keep only the rows of each chunk where mask_func(chunk) is true
+def filter_chunks(chunks, mask_func):
+    for chunk in chunks:
+        mask = np.asarray(mask_func(chunk))
+        if mask.all():
+            yield chunk
+        elif mask.any():
+            yield chunk[mask].reset_index(drop=True)
+
+# keep only the rows within [start_time, end_time] of the corrected clock
+def filter_time(chunks, start_time, end_time, time_column='correct_timestamp'):
+    return filter_chunks(chunks, lambda chunk: (chunk[time_column] >= start_time) & (chunk[time_column] <= end_time))
+
+# accumulate count, mean, std, min and max per column without holding more than one chunk
+def aggregate_chunks(chunks, columns):
+    count = 0
+    total = np.zeros(len(columns))
+    total_sq = np.zeros(len(columns))
+    minimum = np.full(len(columns), np.inf)
+    maximum = np.full(len(columns), -np.inf)
+    # shift the data by the first chunk's mean to keep the sums of squares well conditioned
+    shift = None
+    for chunk in chunks:
+        values = chunk[columns].to_numpy(dtype=np.float64)
+        if shift is None:
+            shift = values.mean(axis=0)
+        centered = values - shift
+        count += len(values)
+        total += centered.sum(axis=0)
+        total_sq += (centered**2).sum(axis=0)
+        minimum = np.minimum(minimum, values.min(axis=0))
+        maximum = np.maximum(maximum, values.max(axis=0))
+
+    if count == 0:
+        return pd.DataFrame(index=columns, columns=['count', 'mean', 'std', 'min', 'max'], dtype=float)
+    mean = total / count
+    var = total_sq / count - mean**2
+    std = np.sqrt(np.maximum(var, 0) * count / max(count - 1, 1))
+    return pd.DataFrame({'count': count, 'mean': mean + shift, 'std': std, 'min': minimum, 'max': maximum}, index=columns)
+
+# fetch, clock correct and derive norm_acc for the imu data one file at a time
+def stream_imu_data(imu_k3y_id, organization_id, start_date, end_date, jump_limit=3):
+    time_df = correct_drift.fetch_time_data(imu_k3y_id, organization_id, start_date, end_date, compact=True)
+    segments = correct_drift.fit_segments(time_df, jump_limit)
+    chunks = iter_imu_files(imu_k3y_id, organization_id, start_date, end_date)
+    return add_norm_acc(correct_chunks(chunks, segments))
+
+# stream the imu data for a date range and summarise it with bounded memory
+def summarize_imu_data(imu_k3y_id, organization_id, start_date_str, end_date_str, start_time=None, end_time=None):
+    start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d')
+    end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d')
+    chunks = stream_imu_data(imu_k3y_id, organization_id, start_date, end_date)
+    if start_time is not None or end_time is not None:
+        chunks = filter_time(chunks, -np.inf if start_time is None else start_time, np.inf if end_time is None else end_time)
+    return aggregate_chunks(chunks, ACC_COLUMNS + ['norm_acc'])
@@ -0,0 +1,123 @@
+import os
+import argparse
+import datetime
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import pyarrow.compute as pc
+from pyarrow import fs
+import s3_fetch
+import key_index
+
+CANSERVER_PARSED_BUCKET = 'matt3r-canserver-us-west-2'
+IMU_BUCKET = 'matt3r-imu-us-west-2'
+
+# the dataset of a device is stored as <STORE_DIR>/<org>/<k3y>/<stream>/date=<YYYY-MM-DD>/<source file>.parquet
+STORE_DIR = os.environ.get('IMU_STORE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'imu_validation_store'))
+# small row groups let a time range query skip most of a day using the timestamp statistics
+ROW_GROUP_SIZE = 64 * 1024
+STREAMS = ['accel', 'gyro', 'infer', 'can']
+TIME_COLUMNS = {'accel': 'timestamp(epoch in sec)',
+                'gyro': 'timestamp(epoch in sec)',
+                'infer': 'system_clock(epoch)',
+                'can': 'timestamp'}
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+def device_dir(organization_id, k3y_id):
+    return os.path.join(STORE_DIR, organization_id, k3y_id)
+
+# the S3 location and file naming scheme of each stream, older usb devices are stored under 'k3yusb-'
+def stream_sources(organization_id, imu_k3y_id, can_k3y_id=None, usb=False, raw=True):
+    imu_prefix = organization_id + '/' + ('k3yusb-' if usb else 'k3y-') + imu_k3y_id + '/'
+    can_prefix = organization_id + '/' + 'k3y-' + (can_k3y_id or imu_k3y_id) + '/'
+    return {'accel': (IMU_BUCKET, imu_prefix + 'accel/', 'raw_date' if raw else 'date_prefix'),
+            'gyro': (IMU_BUCKET, imu_prefix + 'gyro/', 'raw_date'),
+            'infer': (IMU_BUCKET, imu_prefix + 'infer/', 'date_suffix'),
+            'can': (CANSERVER_PARSED_BUCKET, can_prefix, 'date_prefix')}
+
+# sort a source file by time and write it into the date partitions its rows fall in
+def _write_partitions(table, stream_dir, source_name, time_column):
+    table = table.filter(pc.is_valid(table[time_column]))
+    table = table.sort_by(time_column)
+    times = table[time_column].to_numpy()
+    days = (times // 86400).astype(np.int64)
+    bounds = np.flatnonzero(np.diff(days)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(times)]))
+
+    written = 0
+    for start, end in zip(starts, ends):
+        if end <= start:
+            continue
+        date_str = (datetime.datetime(1970, 1, 1) + datetime.timedelta(days=int(days[start]))).strftime('%Y-%m-%d')
+        part_dir = os.path.join(stream_dir, f'date={date_str}')
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, source_name + '.parquet')
+        tmp_path = path + '.tmp'
+        pq.write_table(table.slice(start, end - start), tmp_path, row_group_size=ROW_GROUP_SIZE, write_statistics=True)
+        os.replace(tmp_path, path)
+        written += int(end - start)
+    return written
+
+# download the four streams of a device for a date range into the local store
+def ingest(organization_id, imu_k3y_id, start_date, end_date, can_k3y_id=None, usb=False, raw=True, streams=STREAMS):
+    sources = stream_sources(organization_id, imu_k3y_id, can_k3y_id, usb, raw)
+    counts = {}
+    for stream in streams:
+        bucket, prefix, scheme = sources[stream]
+        keys, etags = key_index.find_keys(bucket, prefix, scheme, start_date, end_date)
+        stream_dir = os.path.join(device_dir(organization_id, imu_k3y_id), stream)
+        counts[stream] = 0
+        for key in keys:
+            table = s3_fetch.fetch_object(bucket, key, _read_table, etags.get(key))
+            source_name = key.split('/')[-1].split('.')[0]
+            counts[stream] += _write_partitions(table, stream_dir, source_name, TIME_COLUMNS[stream])
+    return counts
+
+def _read_table(body):
+    return pq.read_table(pa.BufferReader(body))
+
+# read the rows of a stream with t0 <= time < t1, only touching the partitions and row groups in range
+def read_table(organization_id, k3y_id, stream, t0, t1, columns=None):
+    stream_dir = os.path.join(device_dir(organization_id, k3y_id), stream)
+    if not os.path.isdir(stream_dir):
+        raise FileNotFoundError(f'no {stream} data stored for {organization_id}/{k3y_id}, run ingest first')
+    time_column = TIME_COLUMNS[stream]
+    dataset = ds.dataset(stream_dir, format='parquet', partitioning=PARTITIONING,
+                         filesystem=fs.LocalFileSystem(use_mmap=True))
+
+    first_date = datetime.datetime.fromtimestamp(t0, datetime.timezone.utc).strftime('%Y-%m-%d')
+    last_date = datetime.datetime.fromtimestamp(t1, datetime.timezone.utc).strftime('%Y-%m-%d')
+    row_filter = ((ds.field('date') >= first_date) & (ds.field('date') <= last_date)
+                  & (ds.field(time_column) >= t0) & (ds.field(time_column) < t1))
+    if columns is not None and time_column not in columns:
+        columns = [time_column] + list(columns)
+    table = dataset.to_table(columns=columns, filter=row_filter)
+    if columns is None:
+        table = table.drop_columns(['date'])
+
+    # partitions and files are read in parallel, so restore the time order
+    return table.sort_by(time_column)
+
+def read_frame(organization_id, k3y_id, stream, t0, t1, columns=None):
+    return read_table(organization_id, k3y_id, stream, t0, t1, columns).to_pandas(split_blocks=True, self_destruct=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Copy the accel, gyro, infer and CAN streams of a device into the local store.')
+    parser.add_argument('organization_id')
+    parser.add_argument('imu_k3y_id')
+    parser.add_argument('start_date', help='YYYY-MM-DD')
+    parser.add_argument('end_date', help='YYYY-MM-DD')
+    parser.add_argument('--can-k3y-id', help='k3y id of the CAN server, defaults to the imu k3y id')
+    parser.add_argument('--usb', action='store_true', help="device data is stored under 'k3yusb-'")
+    parser.add_argument('--corrected', action='store_true', help="ingest '<date>_' accel files instead of 'raw_<date>_'")
+    parser.add_argument('--streams', nargs='+', default=STREAMS, choices=STREAMS)
+    args = parser.parse_args()
+
+    start_date = datetime.datetime.strptime(args.start_date, '%Y-%m-%d')
+    end_date = datetime.datetime.strptime(args.end_date, '%Y-%m-%d')
+    counts = ingest(args.organization_id, args.imu_k3y_id, start_date, end_date, args.can_k3y_id,
+                    args.usb, not args.corrected, args.streams)
+    for stream, count in counts.items():
+        print(f'{stream}: {count} rows')
@@ -0,0 +1,79 @@
+import numpy as np
+import tracing
+
+# closed can be 'both', 'left', 'right' or 'neither', matching pandas.Interval
+CLOSED_OPTIONS = ('both', 'left', 'right', 'neither')
+
+# sort and merge overlapping intervals into disjoint ones, padding each interval first
+def merge_intervals(starts, ends, closed='both', pad_before=0, pad_after=0):
+    if closed not in CLOSED_OPTIONS:
+        raise ValueError(f'closed must be one of {CLOSED_OPTIONS}, got {closed!r}')
+    starts = np.asarray(starts, dtype=np.float64) - pad_before
+    ends = np.asarray(ends, dtype=np.float64) + pad_after
+
+    # drop empty intervals
+    if closed == 'both':
+        keep = starts <= ends
+    else:
+        keep = starts < ends
+    starts = starts[keep]
+    ends = ends[keep]
+    if len(starts) == 0:
+        return starts, ends
+
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = ends[order]
+
+    # an interval starts a new group when it begins after every earlier interval has ended,
+    # touching intervals only merge when the shared point is covered by one of them
+    running_end = np.maximum.accumulate(ends)
+    if closed == 'neither':
+        new_group = starts[1:] >= running_end[:-1]
+    else:
+        new_group = starts[1:] > running_end[:-1]
+    group_starts = np.concatenate(([0], np.flatnonzero(new_group) + 1))
+    group_ends = np.concatenate((group_starts[1:] - 1, [len(starts) - 1]))
+
+    return starts[group_starts], running_end[group_ends]
+
+# return the index of the interval containing each value, -1 outside, for already disjoint sorted intervals
+def interval_index(values, starts, ends, closed='both'):
+    values = np.asarray(values, dtype=np.float64)
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if len(starts) == 0:
+        return np.full(values.shape, -1)
+
+    # locate the last interval starting at or before each value, then check its end
+    if closed in ('both', 'left'):
+        index = np.searchsorted(starts, values, side='right') - 1
+    else:
+        index = np.searchsorted(starts, values, side='left') - 1
+    index_clip = np.clip(index, 0, None)
+    if closed in ('both', 'right'):
+        inside = values <= ends[index_clip]
+    else:
+        inside = values < ends[index_clip]
+
+    return np.where((index >= 0) & inside, index, -1)
+
+# return a mask of the values falling inside any of the intervals
+@tracing.traced(cat='join')
+def in_intervals(values, starts, ends, closed='both', pad_before=0, pad_after=0):
+    starts, ends = merge_intervals(starts, ends, closed, pad_before, pad_after)
+    return interval_index(values, starts, ends, closed) >= 0
+
+# get the start and end times of a state's windows from the event data, parked windows store them as a
+# 'timestamp' pair and the other states as 'start' and 'end'
+def event_intervals(event_dict, state):
+    starts = []
+    ends = []
+    for event in event_dict.get(state, []):
+        if 'timestamp' in event:
+            starts.append(event['timestamp'][0])
+            ends.append(event['timestamp'][1])
+        else:
+            starts.append(event['start'])
+            ends.append(event['end'])
+    return np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import bisect
+import datetime
+import threading
+import s3_fetch
+import tracing
+
+# listings are persisted under <INDEX_DIR>/<bucket>/<prefix>/<scheme>.json
+INDEX_DIR = os.environ.get('IMU_INDEX_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'imu_validation_index'))
+# incremental refreshes only see keys sorting after the last listed key, so relist everything periodically
+# to drop deleted keys and pick up backfilled ones
+FULL_REFRESH_INTERVAL = 6 * 3600
+
+# parse the date out of a file name for each naming scheme, None when the file does not belong to it
+def _parse_date(date_str):
+    if len(date_str) != 10:
+        return None
+    try:
+        datetime.datetime.strptime(date_str, '%Y-%m-%d')
+    except ValueError:
+        return None
+    return date_str
+
+# '<date>_<suffix>.parquet', used by the CAN server and corrected IMU streams
+def date_prefix(name):
+    if name.split('.')[-1] != 'parquet':
+        return None
+    return _parse_date(name.split('_')[0])
+
+# 'raw_<date>_<suffix>.parquet', used by the raw accel and gyro streams
+def raw_date(name):
+    parts = name.split('_')
+    if name.split('.')[-1] != 'parquet' or len(parts) < 2:
+        return None
+    return _parse_date(parts[1])
+
+# '<prefix>_<date>.parquet', used by the infer stream
+def date_suffix(name):
+    stem = name.split('.')[0]
+    if name.split('.')[-1] != 'parquet' or len(stem) == 10:
+        return None
+    return _parse_date(stem.split('_')[-1])
+
+# '<date>.json', used by the CAN server events
+def date_json(name):
+    if name.split('.')[-1] != 'json' or len(name) != 15:
+        return None
+    return _parse_date(name.split('.')[0])
+
+SCHEMES = {'date_prefix': date_prefix, 'raw_date': raw_date, 'date_suffix': date_suffix, 'date_json': date_json}
+# the start of every file name of a scheme, listings are scoped to it so that the files of another scheme sharing
+# the prefix (the accel prefix holds both '<date>_' and 'raw_<date>_' files) never become the last listed key;
+# dated names start with '2' until the year 3000
+LIST_PREFIXES = {'date_prefix': '2', 'raw_date': 'raw_', 'date_suffix': '', 'date_json': '2'}
+
+_indexes = {}
+_lock = threading.Lock()
+
+def _index_path(bucket, prefix, scheme):
+    return os.path.join(INDEX_DIR, bucket, prefix, scheme + '.json')
+
+def _load_index(bucket, prefix, scheme):
+    try:
+        with open(_index_path(bucket, prefix, scheme)) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'last_key': None, 'refreshed': 0, 'last_full_refresh': 0, 'dates': [], 'keys': [], 'etags': []}
+
+def _save_index(bucket, prefix, scheme, index):
+    path = _index_path(bucket, prefix, scheme)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(index, file)
+    os.replace(tmp_path, path)
+
+# list a prefix with full pagination, starting after a key when refreshing incrementally,
+# on_page is called with the items of each page as soon as it arrives
+def list_objects(bucket, prefix, start_after=None, on_page=None):
+    paginator = s3_fetch.get_client().get_paginator('list_objects_v2')
+    params = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        params['StartAfter'] = start_after
+    items = []
+    with tracing.span('s3.list', 'io', bucket=bucket, prefix=prefix, incremental=bool(start_after)) as stage:
+        for page in paginator.paginate(**params):
+            contents = page.get('Contents', [])
+            if on_page is not None:
+                on_page(contents)
+            items.extend(contents)
+            stage.add(pages=1, objects=len(contents))
+    return items
+
+# bring an index up to date, parsing dates only for newly listed keys; also returns the set of keys whose
+# ETags come from this listing, the ETags of the other keys may be stale if their objects were overwritten
+def refresh_index(bucket, prefix, scheme, full=False, on_page=None):
+    parse = SCHEMES[scheme]
+    list_prefix = prefix + LIST_PREFIXES[scheme]
+    with _lock:
+        index = _indexes.get((bucket, prefix, scheme))
+    if index is None:
+        index = _load_index(bucket, prefix, scheme)
+    # indexes saved before last_full_refresh was tracked or before listings were scoped to the scheme get relisted once
+    full = (full or time.time() - index.get('last_full_refresh', 0) > FULL_REFRESH_INTERVAL
+            or (index['last_key'] is not None and not index['last_key'].startswith(list_prefix)))
+
+    # anything changed while the listing runs is picked up by the next full refresh
+    listed_at = time.time()
+    items = list_objects(bucket, list_prefix, None if full else index['last_key'], on_page)
+    if full:
+        entries = []
+    else:
+        entries = list(zip(index['dates'], index['keys'], index['etags']))
+    for item in items:
+        date = parse(item['Key'].split('/')[-1])
+        if date is not None:
+            entries.append((date, item['Key'], item['ETag']))
+    entries.sort()
+
+    last_key = items[-1]['Key'] if items else (None if full else index['last_key'])
+    index = {'last_key': last_key,
+             'refreshed': time.time(),
+             'last_full_refresh': listed_at if full else index.get('last_full_refresh', 0),
+             'dates': [entry[0] for entry in entries],
+             'keys': [entry[1] for entry in entries],
+             'etags': [entry[2] for entry in entries]}
+    with _lock:
+        _indexes[(bucket, prefix, scheme)] = index
+    _save_index(bucket, prefix, scheme, index)
+    return index, {item['Key'] for item in items}
+
+# the first and last file dates within the range, a file dated at midnight is in range if
+# start_date <= midnight <= end_date
+def date_bounds(start_date, end_date):
+    first_date = start_date.date()
+    if start_date > datetime.datetime.combine(first_date, datetime.time.min):
+        first_date = first_date + datetime.timedelta(days=1)
+    return first_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+# return the keys dated within the range, sorted by file name, along with their ETags; the ETag is None for
+# keys this call did not list, so s3_fetch checks them with a HEAD request before trusting its cache
+def find_keys(bucket, prefix, scheme, start_date, end_date, refresh=True, on_page=None):
+    if refresh:
+        index, listed = refresh_index(bucket, prefix, scheme, on_page=on_page)
+    else:
+        listed = set()
+        with _lock:
+            index = _indexes.get((bucket, prefix, scheme))
+        if index is None:
+            index = _load_index(bucket, prefix, scheme)
+
+    first_date, last_date = date_bounds(start_date, end_date)
+    lo = bisect.bisect_left(index['dates'], first_date)
+    hi = bisect.bisect_right(index['dates'], last_date)
+
+    keys = sorted(index['keys'][lo:hi], key=lambda x: x.split('/')[-1].split('.')[0])
+    etags = {key: etag if key in listed else None for key, etag in zip(index['keys'][lo:hi], index['etags'][lo:hi])}
+    return keys, etags
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+import align
+import intervals
+
+AXES = ['lr', 'bf', 'vert']
+IMU_COLUMNS = ['lr_acc(m/s^2)', 'bf_acc(m/s^2)', 'vert_acc(m/s^2)']
+CAN_COLUMNS = ['lr_acc', 'bf_acc', 'vert_acc']
+# the CAN server reports left/right acceleration with the opposite sign to the imu, as in plot_data.triaxis_plot
+CAN_SIGN = np.array([-1.0, 1.0, 1.0])
+CAN_TOLERANCE = 0.1
+# rate of the binned series used for the cross-correlation and the largest lag searched
+LAG_RATE = 10
+MAX_LAG = 5.0
+METRIC_COLUMNS = ['state', 'window', 'start', 'end', 'axis', 'n', 'imu_mean', 'can_mean', 'bias', 'rmse',
+                  'corr', 'lag', 'lag_corr']
+
+# per-axis bias, RMSE, correlation and time lag between the imu and CAN acceleration in every event window,
+# accumulated one imu chunk at a time with running statistics so the joined data is never held in memory
+class WindowMetrics:
+    def __init__(self, can_df, event_dict, states=None, can_tolerance=CAN_TOLERANCE, lag_rate=LAG_RATE, max_lag=MAX_LAG):
+        # only the rows carrying acceleration, the other CAN signals are interleaved on rows of their own
+        self.can_times, can_values = align.sorted_arrays(align.finite_rows(can_df, CAN_COLUMNS), 'timestamp', CAN_COLUMNS)
+        self.can_values = can_values.astype(np.float64) * CAN_SIGN
+        self.can_tolerance = can_tolerance
+        self.lag_rate = lag_rate
+        self.max_lag = max_lag
+
+        self.windows = []
+        for state in (states if states is not None else event_dict.keys()):
+            starts, ends = intervals.event_intervals(event_dict, state)
+            for index, (start, end) in enumerate(zip(starts, ends)):
+                if end > start:
+                    self.windows.append(_new_window(state, index, start, end, lag_rate))
+        self.windows.sort(key=lambda window: window['start'])
+        self._starts = np.array([window['start'] for window in self.windows])
+        self._ends = np.maximum.accumulate(np.array([window['end'] for window in self.windows])) if self.windows else np.array([])
+
+    # add a chunk of corrected imu data
+    def update(self, imu_df, time_column=None):
+        if time_column is None:
+            time_column = align.imu_time_column(imu_df)
+        times, values = align.sorted_arrays(imu_df, time_column, IMU_COLUMNS)
+        if len(times) == 0 or not self.windows:
+            return self
+
+        # only visit the windows overlapping the chunk
+        first = np.searchsorted(self._ends, times[0], side='left')
+        last = np.searchsorted(self._starts, times[-1], side='right')
+        for window in self.windows[first:last]:
+            lo = np.searchsorted(times, window['start'], side='left')
+            hi = np.searchsorted(times, window['end'], side='right')
+            if hi > lo:
+                self._add(window, times[lo:hi], values[lo:hi].astype(np.float64))
+        return self
+
+    def _add(self, window, times, imu_values):
+        # pair each imu sample with the nearest CAN sample
+        index = align.asof_index(self.can_times, times, self.can_tolerance, 'nearest')
+        valid = index >= 0
+        if valid.any():
+            _merge_moments(window['moments'], imu_values[valid], self.can_values[index[valid]])
+
+        # bin the imu series for the lag search
+        bins = ((times - window['start']) * self.lag_rate).astype(np.int64)
+        n_bins = len(window['imu_count'])
+        in_range = (bins >= 0) & (bins < n_bins)
+        bins = bins[in_range]
+        window['imu_count'] += np.bincount(bins, minlength=n_bins)
+        for axis in range(3):
+            window['imu_sum'][:, axis] += np.bincount(bins, weights=imu_values[in_range, axis], minlength=n_bins)
+
+    # one row per window and axis
+    def table(self):
+        rows = []
+        for window in self.windows:
+            can_binned = self._can_binned(window)
+            for axis, name in enumerate(AXES):
+                moments = window['moments']
+                n = moments['n']
+                row = {'state': window['state'], 'window': window['index'], 'start': window['start'],
+                       'end': window['end'], 'axis': name, 'n': n}
+                if n > 0:
+                    var_imu = moments['m_imu'][axis] / n
+                    var_can = moments['m_can'][axis] / n
+                    cov = moments['c'][axis] / n
+                    bias = moments['mean_imu'][axis] - moments['mean_can'][axis]
+                    row.update({'imu_mean': moments['mean_imu'][axis],
+                                'can_mean': moments['mean_can'][axis],
+                                'bias': bias,
+                                # mean squared difference = variance of the difference + bias^2
+                                'rmse': np.sqrt(max(var_imu + var_can - 2 * cov, 0) + bias**2),
+                                'corr': cov / np.sqrt(var_imu * var_can) if var_imu > 0 and var_can > 0 else np.nan})
+                row['lag'], row['lag_corr'] = self._lag(window, can_binned, axis)
+                rows.append(row)
+        return pd.DataFrame(rows, columns=METRIC_COLUMNS)
+
+    def _can_binned(self, window):
+        lo = np.searchsorted(self.can_times, window['start'], side='left')
+        hi = np.searchsorted(self.can_times, window['end'], side='right')
+        bins = ((self.can_times[lo:hi] - window['start']) * self.lag_rate).astype(np.int64)
+        n_bins = len(window['imu_count'])
+        in_range = (bins >= 0) & (bins < n_bins)
+        bins = bins[in_range]
+        count = np.bincount(bins, minlength=n_bins)
+        sums = np.column_stack([np.bincount(bins, weights=self.can_values[lo:hi][in_range, axis], minlength=n_bins)
+                                for axis in range(3)])
+        return count, sums
+
+    # lag in seconds that best aligns the imu to CAN, positive when the imu lags behind
+    def _lag(self, window, can_binned, axis):
+        imu = _binned_series(window['imu_count'], window['imu_sum'][:, axis])
+        can = _binned_series(can_binned[0], can_binned[1][:, axis])
+        if imu is None or can is None:
+            return np.nan, np.nan
+        max_shift = min(int(self.max_lag * self.lag_rate), len(imu) - 1)
+        xcorr = cross_correlation(imu, can, max_shift)
+        if xcorr is None:
+            return np.nan, np.nan
+        best = int(np.argmax(xcorr))
+        # refine the peak between bins with a parabola through its neighbours
+        shift = float(best)
+        if 0 < best < len(xcorr) - 1:
+            curvature = xcorr[best - 1] - 2 * xcorr[best] + xcorr[best + 1]
+            if curvature < 0:
+                shift += 0.5 * (xcorr[best - 1] - xcorr[best + 1]) / curvature
+        return (max_shift - shift) / self.lag_rate, xcorr[best]
+
+def _new_window(state, index, start, end, lag_rate):
+    n_bins = int(np.ceil((end - start) * lag_rate)) + 1
+    return {'state': state, 'index': index, 'start': float(start), 'end': float(end),
+            'moments': {'n': 0, 'mean_imu': np.zeros(3), 'mean_can': np.zeros(3),
+                        'm_imu': np.zeros(3), 'm_can': np.zeros(3), 'c': np.zeros(3)},
+            'imu_count': np.zeros(n_bins, dtype=np.int64),
+            'imu_sum': np.zeros((n_bins, 3))}
+
+# merge a batch of paired samples into the running means and centred moments
+def _merge_moments(moments, imu, can):
+    n_b = len(imu)
+    mean_imu_b = imu.mean(axis=0)
+    mean_can_b = can.mean(axis=0)
+    d_imu = imu - mean_imu_b
+    d_can = can - mean_can_b
+
+    n_a = moments['n']
+    n = n_a + n_b
+    delta_imu = mean_imu_b - moments['mean_imu']
+    delta_can = mean_can_b - moments['mean_can']
+    weight = n_a * n_b / n
+    moments['mean_imu'] = moments['mean_imu'] + delta_imu * n_b / n
+    moments['mean_can'] = moments['mean_can'] + delta_can * n_b / n
+    moments['m_imu'] = moments['m_imu'] + (d_imu**2).sum(axis=0) + delta_imu**2 * weight
+    moments['m_can'] = moments['m_can'] + (d_can**2).sum(axis=0) + delta_can**2 * weight
+    moments['c'] = moments['c'] + (d_imu * d_can).sum(axis=0) + delta_imu * delta_can * weight
+    moments['n'] = n
+
+# bin means with the series mean removed, empty bins contribute nothing to the correlation
+def _binned_series(count, sums):
+    filled = count > 0
+    if filled.sum() < 2:
+        return None
+    series = np.zeros(len(count))
+    series[filled] = sums[filled] / count[filled]
+    series[filled] -= series[filled].mean()
+    return series
+
+# normalised cross-correlation of two equal length series for shifts of -max_shift..max_shift, via FFT,
+# entry k is the correlation of a[t] with b[t + k - max_shift]
+def cross_correlation(a, b, max_shift):
+    norm = np.sqrt((a**2).sum() * (b**2).sum())
+    if norm == 0:
+        return None
+    n = len(a)
+    size = 1 << int(np.ceil(np.log2(2 * n - 1)))
+    spectrum = np.fft.rfft(b, size) * np.conj(np.fft.rfft(a, size))
+    full = np.fft.irfft(spectrum, size)
+    # negative shifts wrap around to the end of the circular correlation
+    xcorr = np.concatenate((full[size - max_shift:], full[:max_shift + 1]))
+    return xcorr / norm
+
+# metrics for a whole frame of corrected imu data
+def window_metrics(imu_df, can_df, event_dict, states=None):
+    return WindowMetrics(can_df, event_dict, states).update(imu_df).table()
+
+# metrics for a stream of corrected imu chunks, such as imu_pipeline.stream_imu_data
+def stream_window_metrics(chunks, can_df, event_dict, states=None):
+    accumulator = WindowMetrics(can_df, event_dict, states)
+    for chunk in chunks:
+        accumulator.update(chunk)
+    return accumulator.table()
@@ -0,0 +1,173 @@
+import argparse
+import datetime
+import itertools
+import numpy as np
+import pandas as pd
+import align
+import schema
+import scoring
+import intervals
+import calibration
+import monitor_motion_state
+
+# trailing window of the rolling features in seconds
+WINDOW = 2.0
+# a sample is moving when the variance of norm_acc ((m/s^2)^2) or the mean squared angular rate ((rad/s)^2)
+# over the window exceeds these, None leaves a feature out
+ACC_VARIANCE = 0.01
+GYRO_ENERGY = None
+# states held for less than this are merged into the state before them
+MIN_DURATION = 10.0
+FEATURE_COLUMNS = ['time', 'acc_variance', 'gyro_energy']
+
+# mean of each value over a trailing window of samples, from a cumulative sum in one vectorized pass
+def rolling_mean(values, window):
+    sums = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    window = max(1, min(window, len(values)))
+    index = np.arange(1, len(values) + 1)
+    start = np.maximum(index - window, 0)
+    return (sums[index] - sums[start]) / (index - start)
+
+def _window_samples(times, window):
+    rate = 1 / np.median(np.diff(times)) if len(times) > 1 else 1.0
+    return int(round(window * rate))
+
+# rolling norm_acc variance and, when the gyro stream is given, rolling gyro energy at every accel sample;
+# each stream is read on its corrected clock when it has one, unless a time column is given for both
+def features(acc_df, gyro_df=None, window=WINDOW, time_column=None):
+    times, acc = align.sorted_arrays(acc_df, time_column or align.imu_time_column(acc_df), align.ACC_COLUMNS)
+    if len(times) == 0:
+        return pd.DataFrame(columns=FEATURE_COLUMNS, dtype=np.float64)
+    norm_acc = np.sqrt((acc.astype(np.float64)**2).sum(axis=1))
+    acc_variance = calibration.rolling_variance(norm_acc[:, None], _window_samples(times, window))[:, 0]
+
+    gyro_energy = np.full(len(times), np.nan)
+    if gyro_df is not None and len(gyro_df):
+        gyro_times, gyro = align.sorted_arrays(gyro_df, time_column or align.imu_time_column(gyro_df), align.GYRO_COLUMNS)
+        energy = rolling_mean((gyro.astype(np.float64)**2).sum(axis=1), _window_samples(gyro_times, window))
+        index = align.asof_index(gyro_times, times, align.IMU_TOLERANCE, 'nearest')
+        gyro_energy[index >= 0] = energy[index[index >= 0]]
+
+    return pd.DataFrame({'time': times, 'acc_variance': acc_variance, 'gyro_energy': gyro_energy})
+
+# merge runs shorter than min_duration into the last run that was long enough
+def debounce(times, moving, min_duration=MIN_DURATION):
+    if min_duration <= 0 or len(moving) == 0:
+        return moving
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(moving)) + 1))
+    run_ends = np.concatenate((run_starts[1:], [len(moving)]))
+    durations = np.append(times[run_starts[1:]], times[-1]) - times[run_starts]
+    # the first run has nothing before it to merge into
+    keep = durations >= min_duration
+    keep[0] = True
+    last_kept = np.maximum.accumulate(np.where(keep, np.arange(len(run_starts)), 0))
+    return np.repeat(moving[run_starts][last_kept], run_ends - run_starts)
+
+# one infer-like row per state change, with the same columns get_imu_driving_data reads from the infer stream;
+# the series is closed with stationary rows so every driving start is paired with an end
+def transitions(times, moving):
+    moving = np.asarray(moving, dtype=bool)
+    if len(moving) == 0:
+        change_times, states = np.empty(0), np.empty(0, dtype=bool)
+    else:
+        change = np.concatenate(([0], np.flatnonzero(np.diff(moving)) + 1))
+        change_times, states = times[change], moving[change]
+        if states[0]:
+            change_times, states = np.concatenate(([times[0]], change_times)), np.concatenate(([False], states))
+        if states[-1]:
+            change_times, states = np.append(change_times, times[-1]), np.append(states, False)
+
+    codes = np.where(states, schema.MOTION_STATES.index('moving'), schema.STATIONARY_CODE)
+    motion_state = pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(schema.MOTION_STATES))
+    return pd.DataFrame({'system_clock(epoch)': change_times, 'motion_state': motion_state})
+
+# re-classify the motion state from the rolling features with one threshold setting
+def classify(feature_df, acc_variance=ACC_VARIANCE, gyro_energy=GYRO_ENERGY, min_duration=MIN_DURATION):
+    times = feature_df['time'].to_numpy()
+    moving = np.zeros(len(times), dtype=bool)
+    if acc_variance is not None:
+        moving |= feature_df['acc_variance'].to_numpy() > acc_variance
+    if gyro_energy is not None:
+        # nan energy, where no gyro sample is near, never marks a sample as moving
+        moving |= feature_df['gyro_energy'].to_numpy() > gyro_energy
+    return transitions(times, debounce(times, moving, min_duration))
+
+# every combination of the threshold values
+def settings_grid(acc_variances, gyro_energies=(GYRO_ENERGY,), min_durations=(MIN_DURATION,)):
+    return [{'acc_variance': acc_variance, 'gyro_energy': gyro_energy, 'min_duration': min_duration}
+            for acc_variance, gyro_energy, min_duration in itertools.product(acc_variances, gyro_energies, min_durations)]
+
+# start and end times of the driving periods of an infer-like frame, paired as get_imu_driving_data pairs them
+def driving_intervals(time_df):
+    times = time_df['system_clock(epoch)'].to_numpy(dtype=np.float64)
+    change = np.diff(schema.is_moving(time_df['motion_state']).astype(np.int8))
+    starts = times[1:][change == 1]
+    ends = times[1:][change == -1]
+    n_states = min(len(starts), len(ends))
+    return starts[:n_states], ends[:n_states]
+
+# flagged samples of a sorted array inside disjoint sorted intervals, from the cumulative sum of the flags
+def _count_in(seconds, cumulative, starts, ends):
+    lo = np.searchsorted(seconds, starts, side='left')
+    hi = np.searchsorted(seconds, ends, side='right')
+    return int((cumulative[hi] - cumulative[lo]).sum())
+
+# score many threshold settings against the CAN data and events from a single pass over the imu data,
+# imu_df and gyro_df are the time corrected frames validate_day works on; the CAN driving timestamps and the
+# event windows are matched to the imu timestamps once, so each setting only costs its classification and a
+# lookup of its driving intervals, with the same TPR and FPR as monitor_motion_state.TPR and FPR
+def sweep(imu_df, can_df, event_dict, settings, gyro_df=None, window=WINDOW):
+    feature_df = features(imu_df, gyro_df, window, time_column='correct_timestamp')
+    can_dr_df = monitor_motion_state.get_can_driving_data(can_df, imu_df)
+
+    all_ns, all_s = scoring.unique_times(imu_df['correct_timestamp'])
+    truth_ns, _ = scoring.unique_times(can_dr_df['correct_timestamp'])
+    dr_starts, dr_ends = intervals.event_intervals(event_dict, 'driving_state')
+    pk_starts, pk_ends = intervals.event_intervals(event_dict, 'parked_state')
+    # imu timestamps a proxy could match for TPR, and those it is scored against for FPR
+    true_driving = scoring.in_sorted(all_ns, truth_ns) & intervals.in_intervals(all_s, dr_starts, dr_ends)
+    parked = intervals.in_intervals(all_s, pk_starts, pk_ends)
+    true_cumulative = np.concatenate(([0], np.cumsum(true_driving)))
+    parked_cumulative = np.concatenate(([0], np.cumsum(parked)))
+    n_parked = int(parked.sum())
+
+    rows = []
+    for setting in settings:
+        time_df = classify(feature_df, **setting)
+        starts, ends = intervals.merge_intervals(*driving_intervals(time_df), pad_before=monitor_motion_state.BUFFER_TIME)
+        tp = _count_in(all_s, true_cumulative, starts, ends)
+        fp = _count_in(all_s, parked_cumulative, starts, ends)
+        row = dict(setting)
+        row.update({'transitions': len(time_df),
+                    'tpr': tp / len(truth_ns) if len(truth_ns) else np.nan,
+                    'fpr': fp / n_parked if n_parked else np.nan})
+        rows.append(row)
+    return pd.DataFrame(rows, columns=['acc_variance', 'gyro_energy', 'min_duration', 'transitions', 'tpr', 'fpr'])
+
+# fetch a device-day once and score every setting on it, the gyro stream is only fetched when a setting uses it
+def sweep_day(organization_id, can_k3y_id, imu_k3y_id, date_str, settings, window=WINDOW):
+    imu_df, time_df, event_dict, can_df = monitor_motion_state.load_day(organization_id, can_k3y_id, imu_k3y_id, date_str)
+    gyro_df = None
+    if any(setting['gyro_energy'] is not None for setting in settings):
+        day = datetime.datetime.strptime(date_str, '%Y-%m-%d')
+        start_date = datetime.datetime.combine(day, datetime.time.min)
+        end_date = datetime.datetime.combine(day, datetime.time.max)
+        gyro_df = monitor_motion_state.fetch_gyro_data(imu_k3y_id, organization_id, start_date, end_date)
+        gyro_df = monitor_motion_state.shift_time(gyro_df, time_df)
+    return sweep(imu_df, can_df, event_dict, settings, gyro_df, window)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-classify the motion state from the raw accel data and score many thresholds.')
+    parser.add_argument('organization_id')
+    parser.add_argument('can_k3y_id')
+    parser.add_argument('imu_k3y_id')
+    parser.add_argument('date', help='YYYY-MM-DD')
+    parser.add_argument('--acc-variances', nargs='+', type=float, default=[0.001, 0.003, 0.01, 0.03, 0.1])
+    parser.add_argument('--gyro-energies', nargs='+', type=float, default=None,
+                        help='gyro energy thresholds in (rad/s)^2, the gyro stream is left out when not given')
+    parser.add_argument('--min-durations', nargs='+', type=float, default=[MIN_DURATION])
+    parser.add_argument('--window', type=float, default=WINDOW, help='rolling window in seconds')
+    args = parser.parse_args()
+
+    settings = settings_grid(args.acc_variances, args.gyro_energies or [GYRO_ENERGY], args.min_durations)
+    print(sweep_day(args.organization_id, args.can_k3y_id, args.imu_k3y_id, args.date, settings, args.window).to_string(index=False))
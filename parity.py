@@ -0,0 +1,148 @@
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import correct_drift
+import synthetic_data
+import scoring
+import monitor_motion_state as mms
+
+# rates are ratios of the same counts, anything above rounding is a real difference
+RATE_TOLERANCE = 1e-12
+# corrected timestamps may differ by float rounding between the scalar and the vectorized expression
+TIME_TOLERANCE = 1e-6
+
+# the per-segment .apply drift correction that correct_drift.correct_timestamps replaced, kept as the reference
+def reference_shift_time(imu_df, time_df, jump_limit=3):
+    # identify any jumps in the data
+    jump_indexes = time_df[abs(time_df['diff_sw_sys(second)'].diff()) > jump_limit].index
+    jump_indexes = jump_indexes.append(pd.Index([time_df.index[-1]]))
+
+    # create a list of the slope segments
+    segments = []
+    index_start = 0
+    for index in jump_indexes:
+        seg_data = {}
+        seg_data['start_timestamp'] = time_df['imu_sw_clock(epoch)'].iloc[index_start]
+        seg_data['end_timestamp'] = time_df['imu_sw_clock(epoch)'].iloc[index]
+        seg_data['slope'], seg_data['intercept'] = np.polyfit(time_df['system_clock(epoch)'][index_start:index],
+                                                            time_df['diff_sw_sys(second)'][index_start:index], 1)
+        seg_data['offset'] = seg_data['slope'] * seg_data['start_timestamp'] + seg_data['intercept']
+        segments.append(seg_data)
+        index_start = index
+
+    for seg in segments:
+        imu_df_seg = imu_df[(imu_df['timestamp(epoch in sec)'] >= seg['start_timestamp'])
+                            & (imu_df['timestamp(epoch in sec)'] < seg['end_timestamp'])]
+        imu_df.loc[imu_df_seg.index, 'correct_timestamp'] = imu_df_seg['timestamp(epoch in sec)'].apply(
+            lambda x: x - (x - seg['start_timestamp']) * seg['slope'] - seg['offset'])
+
+    # drop any nan values
+    imu_df.dropna(inplace=True)
+    imu_df.reset_index(drop=True, inplace=True)
+
+    return imu_df
+
+# a synthetic device whose imu clock jumps forward and later steps back past the start of an earlier segment,
+# so the segment starts are not monotonic and the vectorized correction has to take its ordered fallback
+def parity_config(duration=3600, seed=0):
+    config = synthetic_data.default_config(duration=duration, seed=seed)
+    config['clock_jumps'] = [(0.4 * duration, 5.0), (0.7 * duration, -0.5 * duration)]
+    return config
+
+def _report(name, ok, detail):
+    print(f'{name:<28} {"ok" if ok else "MISMATCH"} {detail}')
+    return ok
+
+# shift_time against the reference on a synthetic day: with imu samples before the first and after the last
+# segment, a forward clock jump and a backward one, and on the infer rows as listed and with two of them swapped
+def check_shift_time(config=None, jump_limits=(3, 2)):
+    if config is None:
+        config = parity_config()
+    _, streams = synthetic_data.generate_day(config, 0)
+    # without the first infer row the first seconds of imu data fall before every segment, and the imu data
+    # always runs past the last infer row
+    infer_df = streams['infer'].iloc[1:].reset_index(drop=True)
+    swapped_df = infer_df.copy()
+    middle = len(swapped_df) // 4
+    swapped_df.iloc[[middle, middle + 1]] = swapped_df.iloc[[middle + 1, middle]].to_numpy()
+
+    ok = True
+    for label, time_df in [('infer', infer_df), ('infer_swapped', swapped_df)]:
+        for jump_limit in jump_limits:
+            expected = reference_shift_time(streams['accel'].copy(), time_df.copy(), jump_limit)
+            actual = correct_drift.shift_time(streams['accel'].copy(), time_df.copy(), jump_limit)
+            same_rows = np.array_equal(expected['timestamp(epoch in sec)'].to_numpy(), actual['timestamp(epoch in sec)'].to_numpy())
+            error = (np.abs(expected['correct_timestamp'].to_numpy() - actual['correct_timestamp'].to_numpy()).max()
+                     if same_rows and len(expected) else 0.0)
+            ok &= _report(f'shift_time {label} {jump_limit}', same_rows and error <= TIME_TOLERANCE,
+                          f'{len(actual)} of {len(streams["accel"])} rows kept, max error {error:.2e} s')
+    return ok
+
+# the .apply labelling and set based TPR/FPR that intervals and scoring replaced, kept as the reference
+def reference_get_imu_driving_data(imu_df, time_df):
+    time_df['motion_bin'] = time_df['motion_state'].apply(lambda x: x != 'stationary').astype(int)
+    dr_start_times = time_df[time_df['motion_bin'].diff() == 1]['system_clock(epoch)'].to_list()
+    dr_end_times = time_df[time_df['motion_bin'].diff() == -1]['system_clock(epoch)'].to_list()
+
+    imu_df['driving_state'] = imu_df['correct_timestamp'].apply(
+        lambda x: any(dr_start - mms.BUFFER_TIME <= x <= dr_end for dr_start, dr_end in zip(dr_start_times, dr_end_times))
+    )
+
+    imu_dr_df = imu_df[imu_df['driving_state']]
+    return imu_dr_df
+
+def reference_TPR(can_dr_df, imu_dr_df, event_dict):
+    dr_start_times = [state['start'] for state in event_dict['driving_state']]
+    dr_end_times = [state['end'] for state in event_dict['driving_state']]
+
+    proxy_set = set(imu_dr_df[imu_dr_df['correct_timestamp'].apply(lambda x: any(start <= x <= end for start, end in zip(dr_start_times, dr_end_times)))]['correct_timestamp'].to_list())
+    truth_set = set(can_dr_df['correct_timestamp'].to_list())
+
+    return len(truth_set.intersection(proxy_set)) / len(truth_set)
+
+def reference_FPR(imu_df, imu_dr_df, event_dict):
+    pk_start_times = [state['timestamp'][0] for state in event_dict['parked_state']]
+    pk_end_times = [state['timestamp'][1] for state in event_dict['parked_state']]
+
+    proxy_set = set(imu_dr_df[imu_dr_df['correct_timestamp'].apply(lambda x: any(start <= x <= end for start, end in zip(pk_start_times, pk_end_times)))]['correct_timestamp'].to_list())
+    truth_set = set(imu_df[imu_df['correct_timestamp'].apply(lambda x: any(start <= x <= end for start, end in zip(pk_start_times, pk_end_times)))]['correct_timestamp'].to_list())
+
+    return len(proxy_set) / len(truth_set)
+
+# the imu driving labels, TPR and FPR of monitor_motion_state and scoring against the reference on a synthetic day
+def check_scoring(config=None):
+    if config is None:
+        config = parity_config()
+    _, streams = synthetic_data.generate_day(config, 0)
+    event_dict = streams['events']['imu_telematics']
+    time_df = streams['infer']
+    imu_df = mms.shift_time(streams['accel'].copy(), time_df.copy())
+    can_dr_df = mms.get_can_driving_data(streams['can'], imu_df)
+
+    expected_dr_df = reference_get_imu_driving_data(imu_df.copy(), time_df.copy())
+    actual_dr_df = mms.get_imu_driving_data(imu_df.copy(), time_df.copy())
+    same_rows = np.array_equal(expected_dr_df['correct_timestamp'].to_numpy(), actual_dr_df['correct_timestamp'].to_numpy())
+    ok = _report('get_imu_driving_data', same_rows, f'{len(actual_dr_df)} of {len(imu_df)} rows driving')
+
+    result, _ = scoring.score(can_dr_df, imu_df, expected_dr_df, event_dict)
+    rates = {'TPR': (reference_TPR(can_dr_df, expected_dr_df, event_dict), mms.TPR(can_dr_df, expected_dr_df, event_dict), result['tpr']),
+             'FPR': (reference_FPR(imu_df, expected_dr_df, event_dict), mms.FPR(imu_df, expected_dr_df, event_dict), result['fpr'])}
+    for name, (expected, actual, scored) in rates.items():
+        ok &= _report(name, abs(actual - expected) <= RATE_TOLERANCE and abs(scored - expected) <= RATE_TOLERANCE,
+                      f'reference {expected:.6f}, {name} {actual:.6f}, scoring.score {scored:.6f}')
+    return ok
+
+CHECKS = {'shift_time': check_shift_time, 'scoring': check_scoring}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the vectorized pipeline against the implementations it replaced.')
+    parser.add_argument('--checks', nargs='+', default=list(CHECKS), choices=list(CHECKS))
+    parser.add_argument('--duration', type=float, default=3600, help='seconds of synthetic data')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = parity_config(args.duration, args.seed)
+    results = [CHECKS[check](config) for check in args.checks]
+    if not all(results):
+        sys.exit(1)
@@ -1,16 +1,60 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import fetch_data
 import numpy as np
-import correct_drift
-import datetime
+import decimate
+
+# min/max bins drawn per pixel of axis width when a series is decimated
+LOD_BINS_PER_PIXEL = 1
 
 ac_sensor = {'name' : 'acc',
              'units' : 'm/s^2',
              'title' : 'Acceleration',
              'scale' : 15}
 
-def triaxis_plot(imu_df, can_df, start_time, sensor=ac_sensor):
+# decimated stand-in for ax.scatter: a visible range holding few samples is drawn as points, a denser one as a
+# min/max segment per bin, and the visible range is decimated again whenever the x limits change
+class LodScatter:
+    def __init__(self, ax, x, y, s=1, color=None, label=None, bins_per_pixel=LOD_BINS_PER_PIXEL):
+        self.ax = ax
+        self.pyramid = decimate.Pyramid(x, y)
+        self.bins_per_pixel = bins_per_pixel
+
+        # both artists are created over the full range so the axes autoscale to the whole series
+        x, y_min, y_max = self._window(*self._data_range())
+        self.points = ax.scatter(x, y_min, s=s, color=color, label=label)
+        facecolors = self.points.get_facecolor()
+        color = facecolors[0] if len(facecolors) else color
+        # projecting caps keep flat bins visible as a dot
+        self.bins = ax.vlines(x, y_min, y_max, colors=[color], linewidth=1, capstyle='projecting')
+        self._set(x, y_min, y_max)
+        # matplotlib only keeps weak references to bound methods, the closure is held strongly and keeps this
+        # object alive for as long as the axes even though the plotting functions drop it
+        ax.callbacks.connect('xlim_changed', lambda ax: self._update(ax))
+
+    def _data_range(self):
+        if len(self.pyramid) == 0:
+            return 0.0, 0.0
+        return self.pyramid.x[0], self.pyramid.x[-1]
+
+    def _window(self, x0, x1):
+        return self.pyramid.window(x0, x1, max(self.ax.bbox.width, 1) * self.bins_per_pixel)
+
+    def _set(self, x, y_min, y_max):
+        if y_min is y_max:
+            self.points.set_offsets(np.column_stack((x, y_min)))
+            self.bins.set_segments([])
+        else:
+            self.points.set_offsets(np.empty((0, 2)))
+            self.bins.set_segments(np.stack((np.column_stack((x, y_min)), np.column_stack((x, y_max))), axis=1))
+
+    def _update(self, ax):
+        self._set(*self._window(*ax.get_xlim()))
+
+def _scatter(ax, x, y, lod, **kwargs):
+    if lod:
+        return LodScatter(ax, x, y, **kwargs)
+    return ax.scatter(x=x, y=y, **kwargs)
+
+def triaxis_plot(imu_df, can_df, start_time, sensor=ac_sensor, lod=True):
+    import matplotlib.pyplot as plt
     name = sensor['name']
     units = sensor['units']
     title = sensor['title']
@@ -24,16 +68,16 @@ def triaxis_plot(imu_df, can_df, start_time, sensor=ac_sensor):
 
     fig.set_size_inches(10,6)
 
-    ax1.scatter(x=can_df['timestamp'] - start_time, y=-can_df[f'lr_{name}'], s=1, color='red', label='CANserver')
-    ax1.scatter(x=imu_df[time_data] - start_time, y=imu_df[f'lr_{name}({units})'], s=1, label='IMU')
+    _scatter(ax1, can_df['timestamp'] - start_time, -can_df[f'lr_{name}'], lod, s=1, color='red', label='CANserver')
+    _scatter(ax1, imu_df[time_data] - start_time, imu_df[f'lr_{name}({units})'], lod, s=1, label='IMU')
     ax1.set_ylim(-scale, scale)
 
-    ax2.scatter(x=can_df['timestamp'] - start_time, y=can_df[f'bf_{name}'], s=1, color='red', label='CANserver')
-    ax2.scatter(x=imu_df[time_data] - start_time, y=imu_df[f'bf_{name}({units})'], s=1, label='IMU')
+    _scatter(ax2, can_df['timestamp'] - start_time, can_df[f'bf_{name}'], lod, s=1, color='red', label='CANserver')
+    _scatter(ax2, imu_df[time_data] - start_time, imu_df[f'bf_{name}({units})'], lod, s=1, label='IMU')
     ax2.set_ylim(-scale, scale)
 
-    ax3.scatter(x=can_df['timestamp'] - start_time, y=can_df[f'vert_{name}'], s=1, color='red', label='CANserver')
-    ax3.scatter(x=imu_df[time_data] - start_time, y=imu_df[f'vert_{name}({units})'], s=1, label='IMU')
+    _scatter(ax3, can_df['timestamp'] - start_time, can_df[f'vert_{name}'], lod, s=1, color='red', label='CANserver')
+    _scatter(ax3, imu_df[time_data] - start_time, imu_df[f'vert_{name}({units})'], lod, s=1, label='IMU')
     ax3.set_ylim(-scale, scale)
 
     fig.suptitle(f"IMU {title} Metrics for Driving State Data")
@@ -49,11 +93,12 @@ def triaxis_plot(imu_df, can_df, start_time, sensor=ac_sensor):
     plt.tight_layout()
     plt.show()
 
-def double_plot(x_data, x_data2, y_data1, y_data2, title, write_slope=True):
+def double_plot(x_data, x_data2, y_data1, y_data2, title, write_slope=True, lod=True):
+    import matplotlib.pyplot as plt
 
     fig, ax = plt.subplots()
-    ax.scatter(x=x_data, y=y_data1, s=1)
-    ax.scatter(x=x_data2, y=y_data2, s=1)
+    _scatter(ax, x_data, y_data1, lod, s=1)
+    _scatter(ax, x_data2, y_data2, lod, s=1)
     plt.title(title, wrap = True)
     plt.xlabel('Elapsed Time (h)')
     plt.ylabel('Clock Difference (s)')
@@ -0,0 +1,75 @@
+import os
+import glob
+import uuid
+
+# objects are stored as downloaded under <CACHE_DIR>/<bucket>/<key>.<etag>
+CACHE_DIR = os.environ.get('IMU_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'imu_validation'))
+CACHE_SIZE_LIMIT = int(os.environ.get('IMU_CACHE_SIZE_LIMIT', 20 * 1024**3))
+CACHE_ENABLED = os.environ.get('IMU_CACHE_ENABLED', '1') != '0'
+
+# locate the cached copy of an object version
+def cache_path(bucket, key, etag):
+    return os.path.join(CACHE_DIR, bucket, key + '.' + etag.strip('"'))
+
+# return the cached body for this object version, or None on a miss
+def read_cached(bucket, key, etag):
+    path = cache_path(bucket, key, etag)
+    try:
+        with open(path, 'rb') as file:
+            body = file.read()
+    except FileNotFoundError:
+        return None
+    # mark the entry as recently used for eviction
+    os.utime(path)
+    return body
+
+# store an object version, replacing any older versions of the same key
+def write_cached(bucket, key, etag, body):
+    path = cache_path(bucket, key, etag)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    key_path = os.path.join(CACHE_DIR, bucket, key)
+    for stale_path in glob.glob(glob.escape(key_path) + '.*'):
+        stale_etag = stale_path[len(key_path) + 1:]
+        if stale_path != path and '.' not in stale_etag:
+            _remove(stale_path)
+
+    # write to a temporary file first so readers never see a partial object
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(body)
+    os.replace(tmp_path, path)
+
+# remove the least recently used entries until the cache fits within the size limit
+def evict(size_limit=None):
+    if size_limit is None:
+        size_limit = CACHE_SIZE_LIMIT
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= size_limit:
+            break
+        _remove(path)
+        total_size -= size
+
+    return total_size
+
+# delete every cached object
+def clear():
+    evict(size_limit=0)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
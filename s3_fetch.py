@@ -0,0 +1,110 @@
+import json
+import threading
+import s3_cache
+import schema
+import tracing
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+# number of objects downloaded at once, the connection pool is sized to match
+MAX_WORKERS = 16
+MAX_POOL_CONNECTIONS = 64
+
+# boto3 and pandas take seconds to import, so they are only loaded once data is actually fetched
+_client = None
+_client_lock = threading.Lock()
+
+# the S3 client shared by every loader, created on first use
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                from botocore.config import Config
+                _client = boto3.client('s3', config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
+    return _client
+
+# parse a downloaded parquet object
+def read_parquet(body):
+    import pandas as pd
+    return pd.read_parquet(BytesIO(body), engine='pyarrow')
+
+# parse a downloaded json object
+def read_json(body):
+    return json.loads(body.decode())
+
+# download the body of an object, reading it from the local cache when the ETag still matches
+def fetch_body(bucket, key, etag=None):
+    with tracing.span('s3.get', 'io', key=key) as stage:
+        body, downloaded = _fetch_body(bucket, key, etag)
+        stage.set(bytes=len(body), downloaded=int(downloaded))
+    return body, downloaded
+
+def _fetch_body(bucket, key, etag):
+    if not s3_cache.CACHE_ENABLED:
+        response = get_client().get_object(Bucket=bucket, Key=key)
+        return response['Body'].read(), False
+
+    # a HEAD request is enough to check freshness when the ETag did not come from a listing
+    if etag is None:
+        etag = get_client().head_object(Bucket=bucket, Key=key)['ETag']
+    body = s3_cache.read_cached(bucket, key, etag)
+    if body is not None:
+        return body, False
+
+    response = get_client().get_object(Bucket=bucket, Key=key)
+    body = response['Body'].read()
+    s3_cache.write_cached(bucket, key, response['ETag'], body)
+    return body, True
+
+# download a single object and parse its body
+def fetch_object(bucket, key, parse, etag=None):
+    body, _ = fetch_body(bucket, key, etag)
+    return parse(body)
+
+# download and parse objects concurrently, returning the results in the same order as the keys
+def fetch_objects(bucket, keys, parse, max_workers=None, etags=None):
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    if etags is None:
+        etags = {}
+    max_workers = max(1, min(max_workers, MAX_POOL_CONNECTIONS, len(keys)))
+
+    def fetch(key):
+        body, downloaded = fetch_body(bucket, key, etags.get(key))
+        with tracing.span('parse', 'cpu', key=key, bytes=len(body)) as stage:
+            result = parse(body)
+            if hasattr(result, 'shape'):
+                stage.set(rows_out=result.shape[0])
+        return result, downloaded
+
+    with tracing.span('s3.fetch_objects', 'io', bucket=bucket, objects=len(keys), workers=max_workers) as stage:
+        if len(keys) <= 1 or max_workers == 1:
+            results = [fetch(key) for key in keys]
+        else:
+            # each worker parses its object as soon as the download completes
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(fetch, keys))
+        stage.set(downloaded=sum(downloaded for _, downloaded in results))
+
+    # keep the cache within its size limit after new objects were stored
+    if any(downloaded for _, downloaded in results):
+        with tracing.span('s3_cache.evict', 'io'):
+            s3_cache.evict()
+
+    return [result for result, _ in results]
+
+# download parquet objects concurrently and combine them in key order,
+# reading only the columns of the stream's compact schema when a stream is given
+def fetch_parquet(bucket, keys, max_workers=None, etags=None, stream=None):
+    import pandas as pd
+    parse = read_parquet if stream is None else schema.parquet_reader(stream)
+    df_list = fetch_objects(bucket, keys, parse, max_workers, etags)
+    with tracing.span('concat', 'cpu', objects=len(df_list)) as stage:
+        df = pd.concat(df_list, axis=0, ignore_index=True)
+        if stream is not None:
+            # files with unexpected motion states have extra categories, so the combined frame is conformed again
+            df = schema.conform(df, stream)
+        stage.set(rows_out=len(df))
+    return df
@@ -0,0 +1,70 @@
+import functools
+from io import BytesIO
+
+# the columns kept for each stream and their in-memory dtypes, anything else in the files is never decoded:
+# clock columns stay float64 epoch seconds, sensor axes and temperatures fit in float32
+COLUMNS = {'accel': {'timestamp(epoch in sec)': 'float64',
+                     'lr_acc(m/s^2)': 'float32',
+                     'bf_acc(m/s^2)': 'float32',
+                     'vert_acc(m/s^2)': 'float32'},
+           'gyro': {'timestamp(epoch in sec)': 'float64',
+                    'lr_w(rad/s)': 'float32',
+                    'bf_w(rad/s)': 'float32',
+                    'vert_w(rad/s)': 'float32'},
+           'infer': {'imu_sw_clock(epoch)': 'float64',
+                     'system_clock(epoch)': 'float64',
+                     'diff_sw_sys(second)': 'float64',
+                     'temp(C)': 'float32',
+                     'motion_state': 'category'},
+           'can': {'timestamp': 'float64',
+                   'speed': 'float32',
+                   'lr_acc': 'float32',
+                   'bf_acc': 'float32',
+                   'vert_acc': 'float32'}}
+
+# the known states come first so their codes are the same in every frame, unknown states are appended after them
+MOTION_STATES = ['stationary', 'moving']
+STATIONARY_CODE = MOTION_STATES.index('stationary')
+EVENT_STATES = ['driving_state', 'parked_state', 'stationary_state']
+
+def _category_dtype(values, known):
+    import pandas as pd
+    extra = sorted(set(values.dropna().unique()) - set(known))
+    return pd.CategoricalDtype(known + extra)
+
+# cast the columns of a stream frame to their compact dtypes, in place
+def conform(df, stream):
+    for column, dtype in COLUMNS[stream].items():
+        if column not in df.columns:
+            continue
+        if dtype == 'category':
+            dtype = _category_dtype(df[column], MOTION_STATES)
+        if df[column].dtype != dtype:
+            df[column] = df[column].astype(dtype)
+    return df
+
+# parse a downloaded parquet object of a stream, only decoding the columns of its schema that the file has
+def read_parquet(body, stream):
+    import pyarrow.parquet as pq
+    file = pq.ParquetFile(BytesIO(body))
+    names = set(file.schema_arrow.names)
+    table = file.read(columns=[column for column in COLUMNS[stream] if column in names])
+    return conform(table.to_pandas(split_blocks=True, self_destruct=True), stream)
+
+# the parse function handed to s3_fetch for a stream
+def parquet_reader(stream):
+    if stream not in COLUMNS:
+        raise ValueError(f'stream must be one of {list(COLUMNS)}, got {stream!r}')
+    return functools.partial(read_parquet, stream=stream)
+
+# mask of the motion states that are not stationary, comparing the category codes when the column is compact
+def is_moving(motion_state):
+    if hasattr(motion_state, 'cat') and motion_state.cat.categories[STATIONARY_CODE] == 'stationary':
+        return motion_state.cat.codes.to_numpy() != STATIONARY_CODE
+    return (motion_state != 'stationary').to_numpy()
+
+# event state names as a category, the known event states first
+def event_states(states):
+    import pandas as pd
+    states = pd.Series(states, dtype=object)
+    return states.astype(_category_dtype(states, EVENT_STATES))
@@ -0,0 +1,93 @@
+import numpy as np
+import intervals
+import schema
+
+NS_PER_S = 1_000_000_000
+WINDOW_COLUMNS = ['state', 'window', 'start', 'end', 'duration', 'n', 'tp', 'fn', 'fp', 'tn', 'rate']
+
+# epoch seconds to int64 nanoseconds, converting the whole and fractional seconds separately because
+# seconds * 1e9 no longer fits the float64 mantissa and would round to 256 ns steps
+def to_ns(times):
+    times = np.asarray(times, dtype=np.float64)
+    seconds = np.floor(times)
+    return seconds.astype(np.int64) * NS_PER_S + np.round((times - seconds) * NS_PER_S).astype(np.int64)
+
+# the distinct timestamps of a column as sorted int64 nanoseconds, with the float seconds of each
+def unique_times(times):
+    times = np.asarray(times, dtype=np.float64)
+    times = times[np.isfinite(times)]
+    ns, index = np.unique(to_ns(times), return_index=True)
+    return ns, times[index]
+
+# mask of the values of a sorted array that also appear in another sorted array
+def in_sorted(values, reference):
+    if len(reference) == 0:
+        return np.zeros(len(values), dtype=bool)
+    index = np.clip(np.searchsorted(reference, values), 0, len(reference) - 1)
+    return reference[index] == values
+
+# number of samples in each window [start, end] and how many of them are flagged, from one cumulative sum
+def _window_counts(seconds, flagged, starts, ends):
+    lo = np.searchsorted(seconds, starts, side='left')
+    hi = np.searchsorted(seconds, ends, side='right')
+    cumulative = np.concatenate(([0], np.cumsum(flagged)))
+    return hi - lo, cumulative[hi] - cumulative[lo]
+
+def _rate(numerator, denominator):
+    return numerator / denominator if denominator else np.nan
+
+# mean of the per-window rates weighted by window duration, over the windows holding any samples
+def duration_weighted(windows):
+    windows = windows[windows['n'] > 0]
+    weight = windows['duration'].sum()
+    return float((windows['rate'] * windows['duration']).sum() / weight) if weight > 0 else np.nan
+
+def _window_frame(state, starts, ends, n, flagged, positive):
+    import pandas as pd
+    n = np.asarray(n, dtype=np.int64)
+    flagged = np.asarray(flagged, dtype=np.int64)
+    missed = n - flagged
+    zeros = np.zeros(len(n), dtype=np.int64)
+    rate = np.where(n > 0, flagged / np.maximum(n, 1), np.nan)
+    return pd.DataFrame({'state': state, 'window': np.arange(len(starts)), 'start': starts, 'end': ends,
+                         'duration': ends - starts, 'n': n,
+                         'tp': flagged if positive else zeros, 'fn': missed if positive else zeros,
+                         'fp': zeros if positive else flagged, 'tn': zeros if positive else missed,
+                         'rate': rate}, columns=WINDOW_COLUMNS)
+
+# share of the truth timestamps also flagged by the proxy inside the driving windows, and the per-window counts
+def true_positive_rate(truth_times, proxy_times, starts, ends, state='driving_state'):
+    truth_ns, truth_s = unique_times(truth_times)
+    proxy_ns, proxy_s = unique_times(proxy_times)
+    proxy_ns = proxy_ns[intervals.in_intervals(proxy_s, starts, ends)]
+    matched = in_sorted(truth_ns, proxy_ns)
+
+    n, tp = _window_counts(truth_s, matched, starts, ends)
+    return _rate(int(matched.sum()), len(truth_ns)), _window_frame(state, starts, ends, n, tp, positive=True)
+
+# share of the timestamps inside the parked windows that the proxy flags as driving, and the per-window counts
+def false_positive_rate(all_times, proxy_times, starts, ends, state='parked_state'):
+    all_ns, all_s = unique_times(all_times)
+    proxy_ns, proxy_s = unique_times(proxy_times)
+    in_parked = intervals.in_intervals(all_s, starts, ends)
+    proxy_in_parked = intervals.in_intervals(proxy_s, starts, ends)
+    flagged = in_sorted(all_ns, proxy_ns[proxy_in_parked])
+
+    n, fp = _window_counts(all_s, flagged, starts, ends)
+    return _rate(int(proxy_in_parked.sum()), int(in_parked.sum())), _window_frame(state, starts, ends, n, fp, positive=False)
+
+# TPR and FPR over the whole range with their duration weighted versions, and the confusion counts per window
+# with the event state as a category
+def score(can_dr_df, imu_df, imu_dr_df, event_dict, time_column='correct_timestamp'):
+    import pandas as pd
+    dr_starts, dr_ends = intervals.event_intervals(event_dict, 'driving_state')
+    pk_starts, pk_ends = intervals.event_intervals(event_dict, 'parked_state')
+    tpr, dr_windows = true_positive_rate(can_dr_df[time_column], imu_dr_df[time_column], dr_starts, dr_ends)
+    fpr, pk_windows = false_positive_rate(imu_df[time_column], imu_dr_df[time_column], pk_starts, pk_ends)
+    result = {'tpr': tpr,
+              'fpr': fpr,
+              'tpr_weighted': duration_weighted(dr_windows),
+              'fpr_weighted': duration_weighted(pk_windows)}
+    windows = pd.concat([dr_windows, pk_windows], ignore_index=True)
+    windows['state'] = schema.event_states(windows['state'].to_numpy())
+    return result, windows
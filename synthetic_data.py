@@ -0,0 +1,177 @@
+import io
+import json
+import datetime
+import numpy as np
+import pandas as pd
+
+CANSERVER_PARSED_BUCKET = 'matt3r-canserver-us-west-2'
+CANSERVER_EVENT_BUCKET = 'matt3r-canserver-event-us-west-2'
+IMU_BUCKET = 'matt3r-imu-us-west-2'
+BUCKETS = [IMU_BUCKET, CANSERVER_PARSED_BUCKET, CANSERVER_EVENT_BUCKET]
+DAY = 86400
+INFER_PERIOD = 24
+GRAVITY = 9.81
+# the columns of a parsed CAN file in their order there
+CAN_COLUMNS = ['timestamp', 'lr_acc', 'bf_acc', 'vert_acc', 'vert_w', 'lr_w', 'bf_w', 'speed', 'lat', 'long', 'ap_state']
+
+# deterministic synthetic K3Y device: alternating parked/driving periods, a drifting imu clock with jumps,
+# and the accel, gyro, infer, CAN and event streams in the same schemas as the S3 buckets
+def default_config(start='2023-07-01', duration=DAY, seed=0):
+    return {'start': start,
+            'duration': duration,
+            'seed': seed,
+            'imu_rate': 100,
+            'can_rate': 10,
+            # imu software clock minus system clock at the start, and its drift in s/s
+            'drift_offset': -1.5,
+            'drift_slope': 2e-5,
+            # (seconds after the start, jump in seconds) of each step in the imu clock
+            'clock_jumps': [(0.4 * duration, 5.0)],
+            # fraction of infer rows whose motion_state disagrees with the vehicle
+            'motion_state_error': 0.02,
+            'min_period': 300,
+            'max_period': 2400}
+
+def _start_time(config):
+    start = datetime.datetime.strptime(config['start'], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    return start.timestamp()
+
+# alternating parked/driving windows covering the whole duration, starting parked
+def drive_schedule(config):
+    rng = np.random.default_rng([config['seed'], 0])
+    t0 = _start_time(config)
+    n_periods = int(config['duration'] / config['min_period']) + 2
+    lengths = rng.uniform(config['min_period'], config['max_period'], n_periods)
+    bounds = t0 + np.concatenate(([0], np.cumsum(lengths)))
+    n_used = np.searchsorted(bounds, t0 + config['duration']) + 1
+    bounds = bounds[:n_used]
+    driving = np.arange(len(bounds) - 1) % 2 == 1
+    return bounds[:-1], bounds[1:], driving
+
+# imu software clock minus system clock at each true time
+def clock_difference(times, config):
+    t0 = _start_time(config)
+    diff = config['drift_offset'] + config['drift_slope'] * (times - t0)
+    for jump_time, jump_size in config['clock_jumps']:
+        diff = diff + np.where(times >= t0 + jump_time, jump_size, 0.0)
+    return diff
+
+def _is_driving(times, schedule):
+    starts, _, driving = schedule
+    index = np.clip(np.searchsorted(starts, times, side='right') - 1, 0, len(starts) - 1)
+    return driving[index]
+
+# generate every stream for one day of the duration
+def generate_day(config, day_index, schedule=None):
+    if schedule is None:
+        schedule = drive_schedule(config)
+    rng = np.random.default_rng([config['seed'], day_index + 1])
+    t0 = _start_time(config)
+    day_start = t0 + day_index * DAY
+    day_end = min(day_start + DAY, t0 + config['duration'])
+    date_str = datetime.datetime.fromtimestamp(day_start, datetime.timezone.utc).strftime('%Y-%m-%d')
+
+    # imu samples are taken on the true clock and stamped with the drifting imu clock
+    times = np.arange(day_start, day_end, 1 / config['imu_rate'])
+    n = len(times)
+    driving = _is_driving(times, schedule)
+    imu_time = times + clock_difference(times, config)
+    scale = np.where(driving, 1.0, 0.05)
+    accel_df = pd.DataFrame({'timestamp(epoch in sec)': imu_time,
+                             'lr_acc(m/s^2)': rng.normal(0, 0.5, n) * scale,
+                             'bf_acc(m/s^2)': (2.0 * np.sin(times / 30) + rng.normal(0, 0.3, n)) * scale,
+                             'vert_acc(m/s^2)': GRAVITY + rng.normal(0, 0.2, n) * scale})
+    gyro_df = pd.DataFrame({'timestamp(epoch in sec)': imu_time,
+                            'lr_w(rad/s)': rng.normal(0, 0.02, n) * scale,
+                            'bf_w(rad/s)': rng.normal(0, 0.02, n) * scale,
+                            'vert_w(rad/s)': (0.1 * np.sin(times / 60) + rng.normal(0, 0.02, n)) * scale})
+
+    # clock comparison and device motion state every INFER_PERIOD seconds
+    infer_times = np.arange(day_start, day_end, INFER_PERIOD)
+    system_clock = infer_times + rng.normal(0, 0.05, len(infer_times))
+    diff = clock_difference(infer_times, config)
+    moving = _is_driving(infer_times, schedule) ^ (rng.random(len(infer_times)) < config['motion_state_error'])
+    infer_df = pd.DataFrame({'imu_sw_clock(epoch)': system_clock + diff,
+                             'system_clock(epoch)': system_clock,
+                             'diff_sw_sys(second)': diff,
+                             'temp(C)': 62.5 + rng.normal(0, 0.2, len(infer_times)),
+                             'motion_state': np.where(moving, 'moving', 'stationary')})
+
+    # CAN server signals on the true clock, interleaved like the parsed CAN files: every row carries only one
+    # group (acceleration, angular rate, speed, position or autopilot state) and leaves the other columns empty
+    period = 1 / config['can_rate']
+    acc_times = np.arange(day_start, day_end, period)
+    acc_driving = _is_driving(acc_times, schedule)
+    w_times = acc_times + period / 3
+    w_driving = _is_driving(w_times, schedule)
+    speed_times = acc_times + 2 * period / 3
+    # position and autopilot state once a second
+    slow_times = np.arange(day_start + 0.5, day_end, 1.0)
+    track = np.cumsum(_is_driving(slow_times, schedule)) * 1e-4
+    groups = [pd.DataFrame({'timestamp': acc_times,
+                            'lr_acc': rng.normal(0, 0.4, len(acc_times)) * acc_driving,
+                            'bf_acc': 2.0 * np.sin(acc_times / 30) * acc_driving,
+                            'vert_acc': rng.normal(0, 0.1, len(acc_times)) * acc_driving}),
+              pd.DataFrame({'timestamp': w_times,
+                            'vert_w': 0.1 * np.sin(w_times / 60) * w_driving,
+                            'lr_w': rng.normal(0, 0.005, len(w_times)) * w_driving,
+                            'bf_w': rng.normal(0, 0.005, len(w_times)) * w_driving}),
+              pd.DataFrame({'timestamp': speed_times,
+                            'speed': np.where(_is_driving(speed_times, schedule), 15 + 5 * np.sin(speed_times / 120), 0.0)}),
+              pd.DataFrame({'timestamp': slow_times, 'lat': 49.25 + track, 'long': -123.1 + track}),
+              pd.DataFrame({'timestamp': slow_times + 0.25, 'ap_state': np.zeros(len(slow_times))})]
+    can_df = (pd.concat(groups, ignore_index=True)
+              .reindex(columns=CAN_COLUMNS)
+              .sort_values('timestamp', kind='stable', ignore_index=True))
+
+    # driving and parked windows overlapping the day
+    starts, ends, is_driving = schedule
+    overlap = (starts < day_end) & (ends > day_start)
+    event_dict = {'imu_telematics': {
+        'driving_state': [{'start': float(s), 'end': float(e)} for s, e, d in zip(starts[overlap], ends[overlap], is_driving[overlap]) if d],
+        'parked_state': [{'timestamp': [float(s), float(e)]} for s, e, d in zip(starts[overlap], ends[overlap], is_driving[overlap]) if not d]}}
+
+    return date_str, {'accel': accel_df, 'gyro': gyro_df, 'infer': infer_df, 'can': can_df, 'events': event_dict}
+
+# yield (date, streams) for every day of the duration
+def iter_days(config):
+    schedule = drive_schedule(config)
+    for day_index in range(int(np.ceil(config['duration'] / DAY))):
+        yield generate_day(config, day_index, schedule)
+
+# the S3 key of each stream for a device-day, following the naming the loaders expect
+def object_keys(org_id, k3y_id, date_str):
+    device = org_id + '/' + 'k3y-' + k3y_id + '/'
+    return {'accel': (IMU_BUCKET, device + 'accel/' + date_str + '_accel.parquet'),
+            'raw_accel': (IMU_BUCKET, device + 'accel/raw_' + date_str + '_accel.parquet'),
+            'raw_gyro': (IMU_BUCKET, device + 'gyro/raw_' + date_str + '_gyro.parquet'),
+            'infer': (IMU_BUCKET, device + 'infer/infer_' + date_str + '.parquet'),
+            'can': (CANSERVER_PARSED_BUCKET, device + date_str + '_can.parquet'),
+            'events': (CANSERVER_EVENT_BUCKET, device + date_str + '.json')}
+
+def _parquet_bytes(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, engine='pyarrow', index=False)
+    return buffer.getvalue()
+
+# create the buckets on a (local) S3 endpoint
+def create_buckets(s3_client, region='us-west-2'):
+    for bucket in BUCKETS:
+        s3_client.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': region})
+
+# generate a device one day at a time and upload it, returning the number of bytes written
+def upload_device(s3_client, org_id, k3y_id, config):
+    total_bytes = 0
+    for date_str, streams in iter_days(config):
+        keys = object_keys(org_id, k3y_id, date_str)
+        bodies = {'accel': _parquet_bytes(streams['accel']),
+                  'raw_gyro': _parquet_bytes(streams['gyro']),
+                  'infer': _parquet_bytes(streams['infer']),
+                  'can': _parquet_bytes(streams['can']),
+                  'events': json.dumps(streams['events']).encode()}
+        bodies['raw_accel'] = bodies['accel']
+        for stream, body in bodies.items():
+            bucket, key = keys[stream]
+            s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+            total_bytes += len(body)
+    return total_bytes
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import functools
+import threading
+from collections import Counter
+
+# set IMU_TRACE to a path to record every stage of a run as a Chrome trace (chrome://tracing, Perfetto),
+# a '{pid}' in the path is replaced by the process id, worker processes write to '<path>.<pid>' otherwise
+TRACE_PATH = os.environ.get('IMU_TRACE')
+# seconds between the stack samples of the optional sampling profiler, 0 leaves it off
+PROFILE_INTERVAL = float(os.environ.get('IMU_PROFILE_INTERVAL', 0))
+MB = 1024**2
+SUMMED_ARGS = ['bytes', 'objects', 'pages', 'downloaded', 'rows_in', 'rows_out']
+
+_enabled = TRACE_PATH is not None
+_events = []
+_origin = time.perf_counter()
+_sampler = None
+# forked workers inherit this, so they can tell they are not the process that started tracing
+_main_pid = os.getpid()
+
+# current resident memory in bytes
+def current_rss():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # without /proc only the lifetime peak is available
+        return peak_rss()
+
+# highest resident memory of the process so far in bytes
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# rows of a frame or array, None for anything else
+def _rows(value):
+    shape = getattr(value, 'shape', None)
+    return shape[0] if shape else None
+
+# a timed stage, recorded as a complete ('X') event with its counters and memory use as args
+class Span:
+    __slots__ = ('name', 'cat', 'args', 'start', 'rss')
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    # add to counters such as bytes, objects or rows_out
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.args[key] = self.args.get(key, 0) + value
+
+    def set(self, **values):
+        self.args.update(values)
+
+    def __enter__(self):
+        self.rss = current_rss()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        rss = current_rss()
+        self.args.update({'rss_mb': rss / MB, 'rss_delta_mb': (rss - self.rss) / MB, 'peak_rss_mb': peak_rss() / MB})
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        # list.append is atomic, so spans closing on download threads need no lock
+        _events.append({'name': self.name, 'cat': self.cat, 'ph': 'X',
+                        'ts': (self.start - _origin) * 1e6, 'dur': (end - self.start) * 1e6,
+                        'pid': os.getpid(), 'tid': threading.get_ident(), 'args': self.args})
+        return False
+
+# stands in for every span while tracing is off, so an instrumented stage costs one flag check
+class _NullSpan:
+    __slots__ = ()
+
+    def add(self, **counts):
+        pass
+
+    def set(self, **values):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def enabled():
+    return _enabled
+
+def span(name, cat='stage', **args):
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, cat, args)
+
+# trace every call of a function, recording the rows of its first argument and of its result
+def traced(name=None, cat='stage'):
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(label, cat, {}) as stage:
+                rows = _rows(args[0]) if args else None
+                if rows is not None:
+                    stage.args['rows_in'] = rows
+                result = func(*args, **kwargs)
+                rows = _rows(result)
+                if rows is not None:
+                    stage.args['rows_out'] = rows
+                return result
+        return wrapper
+    return decorator
+
+# turn tracing on for this process, optionally with the sampling profiler
+def enable(path=None, profile_interval=None):
+    global _enabled, TRACE_PATH
+    _enabled = True
+    if path is not None:
+        TRACE_PATH = path
+    if profile_interval:
+        start_profiler(profile_interval)
+
+def disable():
+    global _enabled
+    _enabled = False
+    stop_profiler()
+
+def clear():
+    _events.clear()
+    if _sampler is not None:
+        _sampler.stacks.clear()
+
+def events():
+    return list(_events)
+
+# total time, calls and summed counters per stage, with the largest peak memory seen at its end
+def summary():
+    stages = {}
+    for event in _events:
+        stage = stages.setdefault(event['name'], {'name': event['name'], 'cat': event['cat'], 'calls': 0,
+                                                  'total_s': 0.0, 'max_s': 0.0, 'peak_rss_mb': 0.0})
+        duration = event['dur'] / 1e6
+        stage['calls'] += 1
+        stage['total_s'] += duration
+        stage['max_s'] = max(stage['max_s'], duration)
+        stage['peak_rss_mb'] = max(stage['peak_rss_mb'], event['args'].get('peak_rss_mb', 0.0))
+        for key in SUMMED_ARGS:
+            if key in event['args']:
+                stage[key] = stage.get(key, 0) + event['args'][key]
+    return sorted(stages.values(), key=lambda stage: -stage['total_s'])
+
+def _path(path):
+    path = path or TRACE_PATH
+    if path is None:
+        raise ValueError('no trace path given and IMU_TRACE is not set')
+    if '{pid}' not in path and os.getpid() != _main_pid:
+        # a worker writes its own file beside the main one
+        path = path + '.{pid}'
+    return path.replace('{pid}', str(os.getpid()))
+
+# write the recorded spans as a Chrome trace with the per-stage summary alongside,
+# and the profiler samples as folded stacks next to it
+def save(path=None):
+    path = _path(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'traceEvents': _events, 'displayTimeUnit': 'ms', 'otherData': {'summary': summary()}}, file)
+    os.replace(tmp_path, path)
+    if _sampler is not None and _sampler.stacks:
+        with open(path + '.folded', 'w') as file:
+            for stack, count in _sampler.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+    return path
+
+# sample the stack of every other thread at a fixed interval, counting each distinct stack
+class _Sampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='tracing_sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def start_profiler(interval=0.005):
+    global _sampler
+    if _sampler is None or not _sampler.is_alive():
+        _sampler = _Sampler(interval)
+        _sampler.start()
+
+def stop_profiler():
+    if _sampler is not None:
+        _sampler.stop()
+
+def _save_at_exit():
+    if _enabled and TRACE_PATH is not None and _events:
+        save()
+
+if _enabled and PROFILE_INTERVAL > 0:
+    start_profiler(PROFILE_INTERVAL)
+atexit.register(_save_at_exit)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Print the per-stage summary of a saved trace.')
+    parser.add_argument('trace', help='trace json written with IMU_TRACE or tracing.save')
+    args = parser.parse_args()
+
+    # only reading a trace, never write one at exit
+    disable()
+    with open(args.trace) as file:
+        _events.extend(json.load(file)['traceEvents'])
+    for stage in summary():
+        counters = ' '.join(f'{key}={stage[key]}' for key in SUMMED_ARGS if key in stage)
+        print(f"{stage['name']:<24} {stage['calls']:>6} calls {stage['total_s']:9.3f} s "
+              f"{stage['peak_rss_mb']:9.1f} MB {counters}")